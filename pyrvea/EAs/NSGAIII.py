@@ -28,6 +28,7 @@ class NSGAIII(BaseDecompositionEA):
         plotting: bool = True,
         logging: bool = False,
         logfile=None,
+        memory_budget: int = None,
         **kwargs
     ):
         lattice_resolution_options = {
@@ -66,6 +67,7 @@ class NSGAIII(BaseDecompositionEA):
             "total_generations": iterations * generations_per_iteration,
             "reference_vectors": reference_vectors,
             "extreme_points": None,
+            "memory_budget": memory_budget,
         }
         nsga3params.update(kwargs)
         return nsga3params
@@ -78,6 +80,7 @@ class NSGAIII(BaseDecompositionEA):
             population.worst_fitness,
             self.params["extreme_points"],
             self.params["population_size"],
+            memory_budget=self.params["memory_budget"],
         )
         self.params["extreme_points"] = extreme_points
         return Selection
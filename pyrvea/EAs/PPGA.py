@@ -1,7 +1,13 @@
+from math import ceil, sqrt
 from random import choice, sample
 import numpy as np
 from pyrvea.Population.Population import Population
-from pygmo import fast_non_dominated_sorting as nds
+from pyrvea.OtherTools.non_dominated_sorting import non_dominated_sort
+
+# Automatically sized lattices have at least this many cells per individual
+_CELLS_PER_INDIVIDUAL = 4
+# Side length of the smallest automatically sized lattice
+_MIN_LATTICE_SIDE = 60
 
 
 class PPGA:
@@ -79,7 +85,8 @@ class PPGA:
         else:
             self.params = self.set_params(population)
 
-        self.lattice = Lattice(60, 60, self.params)
+        size_y, size_x = self.lattice_size(population)
+        self.lattice = Lattice(size_x, size_y, self.params)
 
     def set_params(
         self,
@@ -97,6 +104,8 @@ class PPGA:
         prob_mutation: float = 0.3,
         mut_strength: float = 0.9,
         neighbourhood_radius: int = 3,
+        lattice_size=None,
+        prey_movement: str = "sequential",
         **kwargs
     ):
         """Set up the parameters.
@@ -132,6 +141,14 @@ class PPGA:
             Strength of the mutation.
         neighbourhood_radius : int
             Radius of neighbourhood, or range of vision for predators.
+        lattice_size : int, tuple or None
+            Size of the lattice, either the side of a square lattice or (height,
+            width). If None, a square lattice with at least 60 x 60 cells and 4
+            cells per prey and predator is used.
+        prey_movement : str
+            "sequential" moves the prey one at a time. "synchronous" moves all prey
+            at once, see Lattice.move_prey_synchronous, which is much faster for
+            large populations.
 
         Returns
         -------
@@ -160,11 +177,41 @@ class PPGA:
             "kill_interval": kill_interval,
             "max_rank": max_rank,
             "neighbourhood_radius": neighbourhood_radius,
+            "lattice_size": lattice_size,
+            "prey_movement": prey_movement,
         }
 
         ppgaparams.update(kwargs)
         return ppgaparams
 
+    def lattice_size(self, population: "Population"):
+        """Get the size of the lattice.
+
+        Parameters
+        ----------
+        population : Population
+            Population object.
+
+        Returns
+        -------
+        tuple
+            Height and width of the lattice.
+        """
+        lattice_size = self.params.get("lattice_size")
+        if lattice_size is None:
+            num_individuals = (
+                max(len(population.individuals), self.params["target_pop_size"])
+                + self.params["predator_pop_size"]
+            )
+            side = max(
+                _MIN_LATTICE_SIDE, ceil(sqrt(_CELLS_PER_INDIVIDUAL * num_individuals))
+            )
+            return side, side
+        if np.ndim(lattice_size) == 0:
+            return int(lattice_size), int(lattice_size)
+        size_y, size_x = lattice_size
+        return int(size_y), int(size_x)
+
     def _next_iteration(self, population: "Population"):
         """Run one iteration of EA.
 
@@ -253,7 +300,7 @@ class PPGA:
             List of indices of individuals to be selected.
         """
         # Calculating fronts and ranks
-        _, _, _, rank = nds(population.fitness)
+        _, rank = non_dominated_sort(population.fitness)
         selection = np.nonzero(rank > max_rank)
         return selection[0]
 
@@ -278,7 +325,8 @@ class Lattice:
     lattice : ndarray
         2d array for the lattice.
     predator_pop : ndarray
-        The predator population.
+        The predator population: one weight vector per predator, with one weight
+        per objective.
     predators_loc : list
         Location (x, y) of predators on the lattice.
     preys_loc : list
@@ -302,11 +350,23 @@ class Lattice:
         self.init_prey()
 
     def init_predators(self):
-        """Initialize the predator population, linearly distributed in [0,1]
-        and place them in the lattice randomly."""
+        """Initialize the predator population and place them in the lattice
+        randomly.
+
+        For two objectives, the weight of the first objective is linearly distributed
+        in [0,1]. For more objectives, the weight vectors are drawn uniformly from the
+        unit simplex."""
 
         # Initialize the predator population
-        self.predator_pop = np.linspace(0, 1, num=self.params["predator_pop_size"])
+        num_predators = self.params["predator_pop_size"]
+        num_objectives = self.params["population"].fitness.shape[1]
+        if num_objectives == 2:
+            weights = np.linspace(0, 1, num=num_predators)
+            self.predator_pop = np.column_stack((weights, 1 - weights))
+        else:
+            self.predator_pop = np.random.dirichlet(
+                np.ones(num_objectives), size=num_predators
+            )
 
         # Take random indices from free (==zero) lattice spaces
         free_space = np.transpose(np.nonzero(self.lattice == 0))
@@ -347,6 +407,8 @@ class Lattice:
         mating_pop : list
             List of parent indices to use for mating
         """
+        if self.params.get("prey_movement", "sequential") == "synchronous":
+            return self.move_prey_synchronous()
         mating_pop = []
         for prey, pos in enumerate(self.preys_loc):
 
@@ -394,6 +456,69 @@ class Lattice:
 
         return mating_pop
 
+    def move_prey_synchronous(self):
+        """Move all prey at once and choose mates for breeding.
+
+        As in move_prey, each prey moves with probability prob_prey_move, and tries
+        prey_max_moves times to step to a random cell of its Moore neighbourhood.
+        Here the moving prey take their steps together, in rounds. A step fails if
+        the destination was occupied at the start of the round, and of prey stepping
+        to the same cell, a random one succeeds. After moving, each prey chooses a
+        random mate among the prey in its Moore neighbourhood.
+
+        Returns
+        -------
+        mating_pop : list
+            List of parent indices to use for mating
+        """
+        shape = np.array(self.lattice.shape)
+        locations = np.array(self.preys_loc, dtype=int).reshape(-1, 2)
+        num_prey = len(locations)
+        moves = np.random.random(num_prey) < self.params["prob_prey_move"]
+        moving = np.flatnonzero(moves)
+
+        for _ in range(self.params["prey_max_moves"]):
+            if len(moving) == 0:
+                break
+            destinations = (
+                locations[moving] + np.random.randint(-1, 2, size=(len(moving), 2))
+            ) % shape
+            free = self.lattice[destinations[:, 0], destinations[:, 1]] == 0
+            movers = moving[free]
+            destinations = destinations[free]
+
+            # Resolve collisions: a random one of the prey stepping to a cell moves
+            order = np.random.permutation(len(movers))
+            _, first = np.unique(
+                np.ravel_multi_index(destinations[order].T, self.lattice.shape),
+                return_index=True,
+            )
+            movers = movers[order[first]]
+            destinations = destinations[order[first]]
+
+            # Move prey, clear previous locations
+            self.lattice[locations[movers, 0], locations[movers, 1]] = 0
+            self.lattice[destinations[:, 0], destinations[:, 1]] = movers + 1
+            locations[movers] = destinations
+
+        self.preys_loc = locations.tolist()
+
+        # Choose a random mate from the Moore neighbourhood of each prey
+        offsets = np.array([(dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1)])
+        neighbourhoods = self.lattice[
+            (locations[:, 0, np.newaxis] + offsets[:, 0]) % shape[0],
+            (locations[:, 1, np.newaxis] + offsets[:, 1]) % shape[1],
+        ]
+        mates = (neighbourhoods > 0) & (
+            neighbourhoods != np.arange(1, num_prey + 1)[:, np.newaxis]
+        )
+        keys = np.where(mates, np.random.random(mates.shape), -1)
+        choices = np.argmax(keys, axis=1)
+        prey = np.flatnonzero(np.any(mates, axis=1))
+        # -1 for lattice offset
+        mating_pop = np.column_stack((prey, neighbourhoods[prey, choices[prey]] - 1))
+        return mating_pop.tolist()
+
     def place_offspring(self, offspring):
         """Try to place the offsprings to the lattice. If no empty spot found within
         number of max attempts, do not place.
@@ -448,6 +573,7 @@ class Lattice:
 
         # Track killed preys in list and remove them at the end of the function
         to_be_killed = []
+        fitness = self.params["population"].fitness
 
         for predator, pos in enumerate(self.predators_loc):
 
@@ -461,21 +587,12 @@ class Lattice:
                 # If preys found in the neighbourhood,
                 # calculate their fitness and kill the weakest
                 if len(targets) > 0:
-                    fitness = []
-                    weakest_prey = None
-                    for target in targets:
-
-                        obj1 = self.params["population"].fitness[target - 1][0]
-                        obj2 = self.params["population"].fitness[target - 1][1]
-
-                        fc = (
-                            self.predator_pop[predator] * obj1
-                            + (1 - self.predator_pop[predator]) * obj2
-                        )
-
-                        fitness.append((fc, target))
-                        fitness.sort()
-                        weakest_prey = fitness[-1][1] - 1
+                    # Weighted sum of the objectives, the largest is the weakest.
+                    # Ties go to the prey with the largest index.
+                    weights = self.predator_pop[predator]
+                    fc = np.sum(fitness[targets - 1] * weights, axis=1)
+                    fc[np.isnan(fc)] = np.inf
+                    weakest_prey = int(targets[fc == fc.max()].max()) - 1
 
                     # Kill the weakest prey and move the predator to its place
                     self.lattice[self.preys_loc[weakest_prey][0]][
@@ -546,8 +663,11 @@ class Lattice:
         self.preys_loc = updated_preys
 
         # Update lattice
-        for prey, pos in enumerate(self.preys_loc):
-            self.lattice[pos[0]][pos[1]] = prey + 1
+        if self.preys_loc:
+            locations = np.array(self.preys_loc, dtype=int)
+            self.lattice[locations[:, 0], locations[:, 1]] = np.arange(
+                1, len(locations) + 1
+            )
 
     @staticmethod
     def lattice_wrap_idx(index, lattice_shape):
@@ -593,6 +713,12 @@ class Lattice:
         The neighbouring cells of x, y in radius n*n.
         Defaults to Moore neighbourhood (n=3).
         """
-
-        arr = np.roll(np.roll(arr, shift=-x + 1, axis=0), shift=-y + 1, axis=1)
-        return arr[:n, :n]
+        size_x, size_y = arr.shape
+        n_x = min(n, size_x)
+        n_y = min(n, size_y)
+        # The window starts at arr[x - 1, y - 1] and wraps around the edges
+        if 1 <= x <= size_x - n_x + 1 and 1 <= y <= size_y - n_y + 1:
+            return arr[x - 1 : x - 1 + n_x, y - 1 : y - 1 + n_y].copy()
+        rows = np.arange(x - 1, x - 1 + n_x) % size_x
+        cols = np.arange(y - 1, y - 1 + n_y) % size_y
+        return arr[rows[:, np.newaxis], cols]
@@ -0,0 +1,100 @@
+from collections import OrderedDict
+from threading import Lock
+
+
+class ArrayCache:
+    """Least recently used cache of arrays, bounded by their total size.
+
+    Stored arrays are made read-only, as they are shared by everyone reading them
+    from the cache. The cache can be shared between threads, e.g. those of
+    ThreadPoolEvaluator.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Maximum total size of the cached arrays in bytes.
+
+    Attributes
+    ----------
+    num_bytes : int
+        Total size of the cached arrays in bytes.
+    hits : int
+        Number of successful lookups.
+    misses : int
+        Number of failed lookups.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._arrays = OrderedDict()
+        self._lock = Lock()
+
+    def __getstate__(self):
+        # Locks can not be pickled, e.g. to send the cache to worker processes
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._arrays)
+
+    def get(self, key):
+        """Get an array from the cache.
+
+        Parameters
+        ----------
+        key : hashable
+            Key of the array.
+
+        Returns
+        -------
+        np.ndarray or None
+            The array, or None if it is not in the cache.
+        """
+        with self._lock:
+            array = self._arrays.get(key)
+            if array is None:
+                self.misses += 1
+                return None
+            self._arrays.move_to_end(key)
+            self.hits += 1
+            return array
+
+    def put(self, key, array):
+        """Store an array in the cache, evicting the least recently used arrays if
+        the cache is full.
+
+        Arrays larger than the whole cache are not stored.
+
+        Parameters
+        ----------
+        key : hashable
+            Key of the array.
+        array : np.ndarray
+            The array to store. It is made read-only.
+        """
+        if array.nbytes > self.max_bytes:
+            return
+        array.flags.writeable = False
+        with self._lock:
+            old = self._arrays.pop(key, None)
+            if old is not None:
+                self.num_bytes -= old.nbytes
+            self._arrays[key] = array
+            self.num_bytes += array.nbytes
+            while self.num_bytes > self.max_bytes:
+                _, old = self._arrays.popitem(last=False)
+                self.num_bytes -= old.nbytes
+
+    def clear(self):
+        """Remove all arrays from the cache."""
+        with self._lock:
+            self._arrays.clear()
+            self.num_bytes = 0
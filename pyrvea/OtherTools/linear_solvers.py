@@ -0,0 +1,310 @@
+from threading import Lock
+
+import numpy as np
+from scipy.linalg.lapack import dgeqrf
+
+
+def lstsq(a, b):
+    """Least squares solutions of a stack of linear systems a @ x = b.
+
+    Gives the same solutions as np.linalg.lstsq with rcond=None for each system.
+    For overdetermined systems, [a, b] is first reduced to triangular
+    form with a QR decomposition without forming Q, so that only the small
+    triangular factors are decomposed further in one batched call.
+
+    Parameters
+    ----------
+    a : np.ndarray
+        Coefficient matrices, shape (..., number of equations, number of unknowns).
+    b : np.ndarray
+        Right hand sides, shape (..., number of equations, number of right hand
+        sides). Broadcast against a.
+
+    Returns
+    -------
+    np.ndarray
+        The solutions, shape (..., number of unknowns, number of right hand sides).
+    """
+    num_equations, num_unknowns = a.shape[-2:]
+    b = np.broadcast_to(b, a.shape[:-1] + b.shape[-1:])
+    num_columns = num_unknowns + b.shape[-1]
+    if num_equations > num_columns:
+        batch_shape = a.shape[:-2]
+        # The systems are stored transposed, so that LAPACK can work on them in
+        # place. The copy is contiguous if a is a transposed view.
+        augmented = np.empty(batch_shape + (num_columns, num_equations))
+        augmented[..., :num_unknowns, :] = np.swapaxes(a, -1, -2)
+        augmented[..., num_unknowns:, :] = np.swapaxes(b, -1, -2)
+        r = np.empty(batch_shape + (num_unknowns, num_columns))
+        for index in np.ndindex(*batch_shape):
+            qr, *_ = dgeqrf(augmented[index].T, overwrite_a=True)
+            r[index] = np.triu(qr[:num_unknowns])
+        a = r[..., :num_unknowns]
+        b = r[..., num_unknowns:]
+    u, s, vt = np.linalg.svd(a, full_matrices=False)
+    # Singular values below this are treated as zero, as in np.linalg.lstsq
+    cutoff = np.finfo(s.dtype).eps * max(num_equations, num_unknowns) * s[..., :1]
+    s_inv = np.divide(1, s, out=np.zeros_like(s), where=s > cutoff)
+    return np.swapaxes(vt, -1, -2) @ (
+        s_inv[..., np.newaxis] * (np.swapaxes(u, -1, -2) @ b)
+    )
+
+
+def cholesky_lstsq(a, b, ridge=1e-10):
+    """Least squares solutions of a stack of linear systems a @ x = b, solved from
+    the normal equations.
+
+    Much cheaper than lstsq when there are many more equations than unknowns, but
+    less accurate for ill-conditioned systems. Rank deficient systems are
+    regularized, see solve_normal_equations.
+
+    Parameters
+    ----------
+    a : np.ndarray
+        Coefficient matrices, shape (..., number of equations, number of unknowns).
+    b : np.ndarray
+        Right hand sides, shape (..., number of equations, number of right hand
+        sides). Broadcast against a.
+    ridge : float
+        Relative size of the regularization of rank deficient systems.
+
+    Returns
+    -------
+    np.ndarray
+        The solutions, shape (..., number of unknowns, number of right hand sides).
+    """
+    a_t = np.swapaxes(a, -1, -2)
+    return solve_normal_equations(a_t @ a, a_t @ b, ridge=ridge)
+
+
+def solve_normal_equations(gram, rhs, ridge=1e-10):
+    """Solve a stack of normal equations gram @ x = rhs with Cholesky factorizations.
+
+    Systems whose Gram matrix is singular or too ill-conditioned for the
+    factorization are solved with ridge * (largest diagonal element) added to the
+    diagonal of the Gram matrix. If even that fails, e.g. because of non-finite
+    values, the pseudoinverse of the Gram matrix is used.
+
+    Parameters
+    ----------
+    gram : np.ndarray
+        Gram matrices a.T @ a, shape (..., number of unknowns, number of unknowns).
+    rhs : np.ndarray
+        a.T @ b, shape (..., number of unknowns, number of right hand sides).
+    ridge : float
+        Relative size of the regularization of rank deficient systems.
+
+    Returns
+    -------
+    np.ndarray
+        The solutions, shape (..., number of unknowns, number of right hand sides).
+    """
+    rhs = np.broadcast_to(rhs, gram.shape[:-1] + rhs.shape[-1:])
+    factor, ok = _cholesky(gram)
+    solution = np.empty(rhs.shape)
+    solution[ok] = _cholesky_solve(factor[ok], rhs[ok])
+    if np.all(ok):
+        return solution
+
+    bad = ~ok
+    num_unknowns = gram.shape[-1]
+    scale = np.max(np.diagonal(gram[bad], axis1=-2, axis2=-1), axis=-1)
+    regularized = gram[bad] + (ridge * scale)[:, np.newaxis, np.newaxis] * np.eye(
+        num_unknowns
+    )
+    factor, ok = _cholesky(regularized)
+    fixed = np.empty(rhs[bad].shape)
+    fixed[ok] = _cholesky_solve(factor[ok], rhs[bad][ok])
+    if not np.all(ok):
+        fixed[~ok] = np.linalg.pinv(gram[bad][~ok]) @ rhs[bad][~ok]
+    solution[bad] = fixed
+    return solution
+
+
+# Factorizations with a squared pivot smaller than this, relative to the largest
+# diagonal element of the matrix, are treated as failed
+_PIVOT_TOLERANCE = 1e-12
+
+
+def _cholesky(gram):
+    """Cholesky factors of a stack of matrices, without raising on failure.
+
+    Returns
+    -------
+    factor : np.ndarray
+        The lower triangular factors. Undefined where the factorization failed.
+    ok : np.ndarray
+        Whether the factorization succeeded, one value per matrix.
+    """
+    try:
+        factor = np.linalg.cholesky(gram)
+    except np.linalg.LinAlgError:
+        # Factorize one by one to find the failing matrices
+        factor = np.full(gram.shape, np.nan)
+        for index in np.ndindex(*gram.shape[:-2]):
+            try:
+                factor[index] = np.linalg.cholesky(gram[index])
+            except np.linalg.LinAlgError:
+                pass
+    pivots = np.diagonal(factor, axis1=-2, axis2=-1) ** 2
+    scale = np.max(np.diagonal(gram, axis1=-2, axis2=-1), axis=-1)
+    ok = np.all(pivots > _PIVOT_TOLERANCE * scale[..., np.newaxis], axis=-1)
+    return factor, ok
+
+
+def _cholesky_solve(factor, rhs):
+    """Solve factor @ factor.T @ x = rhs for stacks of lower triangular factors."""
+    y = np.linalg.solve(factor, rhs)
+    return np.linalg.solve(np.swapaxes(factor, -1, -2), y)
+
+
+class GramCache:
+    """Cache of design matrix columns and their dot products.
+
+    Columns are identified by hashable keys. The cache stores each column, its dot
+    product with a fixed target and the dot products between the columns, so that
+    the Gram matrix of a design matrix whose columns were seen before is assembled
+    without touching the data. The cache has a fixed number of slots, and the least
+    recently used columns are replaced when new columns are stored.
+
+    A later lookup may reassign the slots returned by an earlier one, so callers
+    sharing the cache between threads must hold lock from lookup until the results
+    of normal_equations are used.
+
+    Parameters
+    ----------
+    target : np.ndarray
+        Target values, shape (number of rows, number of targets).
+    max_bytes : int
+        Approximate maximum size of the cache in bytes.
+    """
+
+    def __init__(self, target, max_bytes):
+        num_rows = target.shape[0]
+        # Solve 8 * capacity * (rows + targets) + 9 * capacity ** 2 = max_bytes
+        linear = 8 * (num_rows + target.shape[1])
+        capacity = int((np.sqrt(linear ** 2 + 36 * max_bytes) - linear) / 18)
+        self.target = target
+        self.capacity = max(capacity, 0)
+        self.columns = np.empty((self.capacity, num_rows))
+        self.column_target = np.empty((self.capacity, target.shape[1]))
+        self.gram = np.empty((self.capacity, self.capacity))
+        # known[i, j] and known[j, i] are both True if gram[i, j] is up to date.
+        # Replacing the column in a slot only needs to clear its row.
+        self.known = np.zeros((self.capacity, self.capacity), dtype=bool)
+        self.slots = {}
+        self.keys = [None] * self.capacity
+        self.last_used = np.full(self.capacity, -1)
+        self.clock = 0
+        self.lock = Lock()
+
+    def __getstate__(self):
+        # Locks can not be pickled, e.g. to send the cache to worker processes
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = Lock()
+
+    def lookup(self, keys):
+        """Find the slots of columns, reserving slots for unknown columns.
+
+        Parameters
+        ----------
+        keys : list
+            Keys of the columns.
+
+        Returns
+        -------
+        slots : np.ndarray or None
+            Slot of each key. None if there are more distinct keys than slots.
+        new : np.ndarray
+            Indices of the first occurrence of each unknown key in keys. The
+            columns of these keys must be given to store.
+        """
+        self.clock += 1
+        slots = []
+        new = []
+        missing = {}
+        for i, key in enumerate(keys):
+            slot = self.slots.get(key)
+            if slot is None:
+                # Placeholder, replaced by a free slot below
+                if key not in missing:
+                    missing[key] = len(missing)
+                    new.append(i)
+                slot = -1 - missing[key]
+            slots.append(slot)
+        slots = np.asarray(slots, dtype=int)
+        self.last_used[slots[slots >= 0]] = self.clock
+        if len(missing) > np.count_nonzero(self.last_used < self.clock):
+            return None, np.empty(0, dtype=int)
+        # Replace the least recently used columns
+        free = np.argpartition(self.last_used, len(missing) - 1)[: len(missing)]
+        for key, slot in zip(missing, free.tolist()):
+            old_key = self.keys[slot]
+            if old_key is not None:
+                del self.slots[old_key]
+            self.slots[key] = slot
+            self.keys[slot] = key
+        self.known[free] = False
+        self.last_used[free] = self.clock
+        placeholders = slots < 0
+        slots[placeholders] = free[-1 - slots[placeholders]]
+        return slots, np.asarray(new, dtype=int)
+
+    def store(self, slots, columns):
+        """Store columns in their slots.
+
+        Parameters
+        ----------
+        slots : np.ndarray
+            Slots returned by lookup for the new keys.
+        columns : np.ndarray
+            The columns, shape (number of rows, number of columns).
+        """
+        self.columns[slots] = columns.T
+        self.column_target[slots] = columns.T @ self.target
+
+    def normal_equations(self, slots):
+        """Assemble the normal equations of design matrices.
+
+        Only the dot products not yet known are calculated.
+
+        Parameters
+        ----------
+        slots : np.ndarray
+            Slots of the columns of each design matrix, shape (number of matrices,
+            number of columns).
+
+        Returns
+        -------
+        gram : np.ndarray
+            The Gram matrices, shape (number of matrices, number of columns, number
+            of columns).
+        rhs : np.ndarray
+            Dot products of the columns with the target, shape (number of matrices,
+            number of columns, number of targets).
+        """
+        rows = slots[:, :, np.newaxis]
+        cols = slots[:, np.newaxis, :]
+        known = self.known[rows, cols]
+        unknown = ~np.all(known & np.swapaxes(known, 1, 2), axis=2)
+        # Matrices with only new columns are calculated together
+        new = np.all(unknown, axis=1)
+        if np.any(new):
+            columns = self.columns[slots[new]]
+            self.gram[rows[new], cols[new]] = columns @ np.swapaxes(columns, 1, 2)
+            self.known[rows[new], cols[new]] = True
+        for matrix_slots, matrix_unknown in zip(slots[~new], unknown[~new]):
+            if not np.any(matrix_unknown):
+                continue
+            changed = matrix_slots[matrix_unknown]
+            products = self.columns[changed] @ self.columns[matrix_slots].T
+            self.gram[changed[:, np.newaxis], matrix_slots] = products
+            self.gram[matrix_slots[:, np.newaxis], changed] = products.T
+            self.known[changed[:, np.newaxis], matrix_slots] = True
+            self.known[matrix_slots[:, np.newaxis], changed] = True
+        return self.gram[rows, cols], self.column_target[slots]
@@ -0,0 +1,266 @@
+from bisect import bisect_right
+
+import numpy as np
+
+# Problems smaller than this are solved by comparing all pairs of points
+_BRUTE_FORCE_SIZE = 32
+# Maximum number of elements in the temporary dominance arrays
+_MAX_BLOCK_ELEMENTS = 2 ** 22
+
+
+def non_dominated_sort(fitness):
+    """Sort points into non-dominated fronts, assuming minimization.
+
+    Uses an O(N log N) sweep for two objectives, a sweep over staircases for three
+    objectives, and Kung's divide and conquer algorithm to peel off the fronts one
+    by one for more objectives. Identical points are placed in the same front.
+
+    Parameters
+    ----------
+    fitness : array_like
+        The points to sort, one per row.
+
+    Returns
+    -------
+    fronts : list of np.ndarray
+        Indices of the points in each front, the first front being non-dominated.
+    rank : np.ndarray
+        Index of the front of each point.
+    """
+    fitness = np.asarray(fitness, dtype=float)
+    num_points = len(fitness)
+    if num_points == 0:
+        return [], np.empty(0, dtype=int)
+    if fitness.ndim == 1:
+        fitness = fitness.reshape(-1, 1)
+    if fitness.shape[1] <= 2:
+        rank = _rank_2d(fitness)
+    elif fitness.shape[1] == 3:
+        rank = _rank_3d(fitness)
+    else:
+        rank = np.empty(num_points, dtype=int)
+        sorted_out = np.zeros(num_points, dtype=bool)
+        remaining = _lexsort_rows(fitness)
+        front_id = 0
+        while len(remaining) > 0:
+            front = _kung(fitness, remaining)
+            rank[front] = front_id
+            sorted_out[front] = True
+            remaining = remaining[~sorted_out[remaining]]
+            front_id += 1
+    return _fronts_from_rank(rank), rank
+
+
+def non_dominated_front(fitness):
+    """Return the indices of the non-dominated points, assuming minimization.
+
+    Parameters
+    ----------
+    fitness : array_like
+        The points, one per row.
+
+    Returns
+    -------
+    np.ndarray
+        Indices of the non-dominated points in ascending order.
+    """
+    fitness = np.asarray(fitness, dtype=float)
+    if len(fitness) == 0:
+        return np.empty(0, dtype=int)
+    if fitness.ndim == 1:
+        fitness = fitness.reshape(-1, 1)
+    if fitness.shape[1] <= 2:
+        front = _front_2d(fitness)
+    else:
+        front = _kung(fitness, _lexsort_rows(fitness))
+    return np.sort(front)
+
+
+def dominates(a, b):
+    """Return a boolean matrix telling whether points in a dominate points in b.
+
+    Parameters
+    ----------
+    a : np.ndarray
+        Points, shape (number of points in a, number of objectives).
+    b : np.ndarray
+        Points, shape (number of points in b, number of objectives).
+
+    Returns
+    -------
+    np.ndarray
+        Element [i, j] is True if a[i] dominates b[j].
+    """
+    not_worse = np.all(a[:, np.newaxis, :] <= b[np.newaxis, :, :], axis=2)
+    better = np.any(a[:, np.newaxis, :] < b[np.newaxis, :, :], axis=2)
+    return not_worse & better
+
+
+def is_dominated_by(points, others):
+    """Return a boolean array telling which points are dominated by any of others.
+
+    The comparison is done in blocks to bound the size of the temporary arrays.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        Points to check, one per row.
+    others : np.ndarray
+        The possibly dominating points, one per row.
+
+    Returns
+    -------
+    np.ndarray
+        True for the points which are dominated.
+    """
+    dominated = np.zeros(len(points), dtype=bool)
+    if len(others) == 0 or len(points) == 0:
+        return dominated
+    block = max(1, _MAX_BLOCK_ELEMENTS // (len(others) * points.shape[1]))
+    for start in range(0, len(points), block):
+        chunk = slice(start, start + block)
+        dominated[chunk] = np.any(dominates(others, points[chunk]), axis=0)
+    return dominated
+
+
+def _lexsort_rows(fitness):
+    """Indices sorting the rows lexicographically, first objective first.
+
+    After this sorting, a point can only be dominated by points before it.
+    """
+    return np.lexsort(fitness.T[::-1])
+
+
+def _kung(fitness, indices):
+    """Kung's algorithm. Return the non-dominated points among indices.
+
+    Parameters
+    ----------
+    fitness : np.ndarray
+        All points.
+    indices : np.ndarray
+        Indices of the points to consider, sorted lexicographically.
+    """
+    if len(indices) <= _BRUTE_FORCE_SIZE:
+        points = fitness[indices]
+        dominated = np.any(dominates(points, points), axis=0)
+        return indices[~dominated]
+    half = len(indices) // 2
+    top = _kung(fitness, indices[:half])
+    bottom = _kung(fitness, indices[half:])
+    dominated = is_dominated_by(fitness[bottom], fitness[top])
+    return np.concatenate((top, bottom[~dominated]))
+
+
+def _front_2d(fitness):
+    """Non-dominated points for at most two objectives, with one vectorized sweep."""
+    if fitness.shape[1] == 1:
+        return np.flatnonzero(fitness[:, 0] == fitness[:, 0].min())
+    order = np.lexsort((fitness[:, 1], fitness[:, 0]))
+    points = fitness[order]
+    # Identical points form groups. A point is dominated if an earlier point
+    # outside its group is not worse in the second objective.
+    new_group = np.ones(len(points), dtype=bool)
+    new_group[1:] = np.any(points[1:] != points[:-1], axis=1)
+    group_start = np.maximum.accumulate(np.where(new_group, np.arange(len(points)), 0))
+    best_before = np.empty(len(points))
+    best_before[0] = np.inf
+    best_before[1:] = np.minimum.accumulate(points[:-1, 1])
+    dominated = best_before[group_start] <= points[:, 1]
+    return order[~dominated]
+
+
+def _rank_2d(fitness):
+    """Front index of each point for at most two objectives in O(N log N).
+
+    The points are swept in lexicographic order. The last point added to each
+    front has the smallest second objective of the front, so the front of a point
+    is found by a binary search over these values.
+    """
+    if fitness.shape[1] == 1:
+        _, rank = np.unique(fitness[:, 0], return_inverse=True)
+        return rank.reshape(-1)
+    order = np.lexsort((fitness[:, 1], fitness[:, 0]))
+    points = fitness[order]
+    new_group = np.ones(len(points), dtype=bool)
+    new_group[1:] = np.any(points[1:] != points[:-1], axis=1)
+    second = points[:, 1].tolist()
+    sorted_rank = np.empty(len(points), dtype=int)
+    front_tails = []
+    for i, is_new in enumerate(new_group.tolist()):
+        if not is_new:
+            sorted_rank[i] = sorted_rank[i - 1]
+            continue
+        front_id = bisect_right(front_tails, second[i])
+        if front_id == len(front_tails):
+            front_tails.append(second[i])
+        else:
+            front_tails[front_id] = second[i]
+        sorted_rank[i] = front_id
+    rank = np.empty(len(points), dtype=int)
+    rank[order] = sorted_rank
+    return rank
+
+
+def _rank_3d(fitness):
+    """Front index of each point for three objectives.
+
+    The points are swept in lexicographic order, so a point can only be dominated
+    by points already seen. For each front, the seen points are kept as a
+    staircase: the non-dominated points of the last two objectives, sorted by the
+    second objective. A point is dominated by a front if the staircase step at its
+    second objective is not above its third objective. If a front dominates a
+    point, so do all the earlier fronts, so the front of the point is found by a
+    binary search.
+    """
+    order = _lexsort_rows(fitness)
+    points = fitness[order]
+    new_group = np.ones(len(points), dtype=bool)
+    new_group[1:] = np.any(points[1:] != points[:-1], axis=1)
+    second = points[:, 1].tolist()
+    third = points[:, 2].tolist()
+    sorted_rank = np.empty(len(points), dtype=int)
+    # Per front, the second and third objectives of the staircase points
+    stairs_second = []
+    stairs_third = []
+
+    def dominated_by_front(front_id, f2, f3):
+        step = bisect_right(stairs_second[front_id], f2)
+        return step > 0 and stairs_third[front_id][step - 1] <= f3
+
+    for i, is_new in enumerate(new_group.tolist()):
+        if not is_new:
+            sorted_rank[i] = sorted_rank[i - 1]
+            continue
+        f2, f3 = second[i], third[i]
+        low, high = 0, len(stairs_second)
+        while low < high:
+            middle = (low + high) // 2
+            if dominated_by_front(middle, f2, f3):
+                low = middle + 1
+            else:
+                high = middle
+        if low == len(stairs_second):
+            stairs_second.append([f2])
+            stairs_third.append([f3])
+        else:
+            front_second = stairs_second[low]
+            front_third = stairs_third[low]
+            step = bisect_right(front_second, f2)
+            # Remove the steps the new point covers
+            end = step
+            while end < len(front_third) and front_third[end] >= f3:
+                end += 1
+            front_second[step:end] = [f2]
+            front_third[step:end] = [f3]
+        sorted_rank[i] = low
+    rank = np.empty(len(points), dtype=int)
+    rank[order] = sorted_rank
+    return rank
+
+
+def _fronts_from_rank(rank):
+    """List the indices of the points in each front, in ascending order."""
+    order = np.argsort(rank, kind="stable")
+    boundaries = np.flatnonzero(np.diff(rank[order])) + 1
+    return np.split(order, boundaries)
@@ -3,13 +3,15 @@ from collections.abc import Sequence
 from typing import TYPE_CHECKING
 import numpy as np
 import pandas as pd
-from pygmo import fast_non_dominated_sorting as nds
-from pygmo import hypervolume as hv
-from pygmo import non_dominated_front_2d as nd2
 
 from tqdm import tqdm, tqdm_notebook
 
 from pyrvea.Population.create_individuals import create_new_individuals
+from pyrvea.Population.evaluators import get_evaluator
+from pyrvea.OtherTools.non_dominated_sorting import (
+    is_dominated_by,
+    non_dominated_front,
+)
 
 import plotly
 import plotly.graph_objs as go
@@ -17,6 +19,8 @@ import plotly.graph_objs as go
 from pyrvea.OtherTools.plotlyanimate import animate_init_, animate_next_
 from pyrvea.OtherTools.IsNotebook import IsNotebook
 from pyrvea.Recombination import (
+    biogp_array_mutation,
+    biogp_array_xover,
     biogp_xover,
     biogp_mutation,
     evodn2_xover_mutation,
@@ -42,6 +46,8 @@ class Population:
         recombination_type=None,
         crossover_type="simulated_binary_crossover",
         mutation_type="bounded_polynomial_mutation",
+        evaluator=None,
+        evaluator_options=None,
         *args
     ):
         """Initialize the population.
@@ -68,6 +74,19 @@ class Population:
             Recombination functions. If recombination_type is specified, crossover and
             mutation
             will be handled by the same function. If None, they are done separately.
+        evaluator : str or object, optional
+            How the objectives of new individuals are calculated. "serial" (default)
+            uses problem.evaluate_batch. "process" and "thread" evaluate the
+            individuals concurrently in a pool of processes or threads. An object
+            with an evaluate(problem, individuals) method can also be given.
+            See pyrvea.Population.evaluators. The workers of the pools are shut
+            down when evolve finishes, or by close. "process" can not be used if
+            the objectives of the problem modify the individuals (the
+            modifies_individuals attribute of the problem, set e.g. by BioGP),
+            because the changes are made to copies in the workers.
+        evaluator_options : dict, optional
+            Keyword arguments of the evaluator given by name, e.g. max_workers and
+            chunksize of the pools.
 
         """
         self.assign_type = assign_type
@@ -75,12 +94,13 @@ class Population:
         self.lower_limits = np.asarray(problem.lower_limits)
         self.upper_limits = np.asarray(problem.upper_limits)
         self.hyp = 0
-        self.non_dom = 0
         self.pop_size = pop_size
         # Fix to remove the following assumptions
         self.recombination_funcs = {
             "biogp_xover": biogp_xover,
             "biogp_mut": biogp_mutation,
+            "biogp_array_xover": biogp_array_xover,
+            "biogp_array_mut": biogp_array_mutation,
             "evodn2_xover_mutation": evodn2_xover_mutation,
             "evonn_xover_mutation": evonn_xover_mutation,
             "bounded_polynomial_mutation": bounded_polynomial_mutation,
@@ -93,23 +113,32 @@ class Population:
             self.crossover = self.recombination_funcs.get(crossover_type, None)
             self.mutation = self.recombination_funcs.get(mutation_type, None)
         self.problem = problem
+        self.evaluator = get_evaluator(evaluator, evaluator_options, problem)
         self.filename = (
             problem.name + "_" + str(problem.num_of_objectives)
         )  # Used for plotting
         self.plotting = plotting
-        self.individuals = []
-        self.objectives = np.empty((0, self.problem.num_of_objectives), float)
+        # The population is stored column-wise in preallocated buffers. Only the
+        # first self._size rows of each buffer are in use. The individuals buffer is
+        # created on the first add, when the type of the individuals is known.
+        self._size = 0
+        self._capacity = 0
+        self._individuals = None
+        self._objectives = np.empty((0, self.problem.num_of_objectives), float)
         if problem.minimize is not None:
-            self.fitness = self.objectives[:, self.problem.minimize]
-            self.ideal_fitness = np.full((1, self.fitness.shape[1]), np.inf)
+            self._fitness = self._objectives[:, self.problem.minimize]
+            self.ideal_fitness = np.full((1, self._fitness.shape[1]), np.inf)
             self.worst_fitness = -1 * self.ideal_fitness
         else:
-            self.fitness = np.empty((0, self.problem.num_of_objectives), float)
+            self._fitness = np.empty((0, self.problem.num_of_objectives), float)
             self.ideal_fitness = np.full((1, self.problem.num_of_objectives), np.inf)
         self.worst_fitness = -1 * self.ideal_fitness
-        self.constraint_violation = np.empty(
+        self._constraint_violation = np.empty(
             (0, self.problem.num_of_constraints), float
         )
+        # Sorted indices of the non-dominated individuals, updated on add and delete.
+        # None if it has to be recalculated from scratch.
+        self._front = np.empty(0, dtype=int)
         self.archive = pd.DataFrame(
             columns=["generation", "decision_variables", "objective_values"]
         )
@@ -124,18 +153,194 @@ class Population:
             self.figure = []
             self.plot_init_()
 
+    @property
+    def individuals(self):
+        """The individuals of the population.
+
+        A view into the population storage, valid until the next add or delete.
+        Copy the individuals which are kept longer, e.g. a selected model."""
+        if self._individuals is None:
+            return np.empty(0)
+        return self._individuals[: self._size]
+
+    @property
+    def objectives(self):
+        """Objective values of the individuals, one row per individual."""
+        return self._objectives[: self._size]
+
+    @objectives.setter
+    def objectives(self, values):
+        self._objectives = self._new_buffer(values)
+        self._front = None
+
+    @property
+    def fitness(self):
+        """Fitness values of the individuals, one row per individual."""
+        return self._fitness[: self._size]
+
+    @fitness.setter
+    def fitness(self, values):
+        self._fitness = self._new_buffer(values)
+
+    @property
+    def constraint_violation(self):
+        """Constraint violations of the individuals, one row per individual."""
+        return self._constraint_violation[: self._size]
+
+    @constraint_violation.setter
+    def constraint_violation(self, values):
+        self._constraint_violation = self._new_buffer(values)
+
+    def _new_buffer(self, values):
+        """Return a buffer with the population capacity, holding values in its first
+        rows.
+
+        Parameters
+        ----------
+        values: np.ndarray
+            One row per individual of the population.
+        """
+        values = np.asarray(values)
+        assert len(values) == self._size
+        buffer = np.empty((self._capacity,) + values.shape[1:], values.dtype)
+        buffer[: self._size] = values
+        return buffer
+
+    def _reserve(self, num_new: int, new_pop):
+        """Make room in the buffers for num_new more individuals.
+
+        The capacity is at least doubled whenever the buffers are reallocated, so
+        that the cost of growing the population is amortized over the additions.
+
+        Parameters
+        ----------
+        num_new: int
+            Number of individuals to be added.
+        new_pop: array_like
+            The individuals to be added. Decides the type of the individuals buffer
+            when it does not exist yet.
+        """
+        if self._individuals is None:
+            if isinstance(new_pop, np.ndarray) and new_pop.dtype != object:
+                self._individuals = np.empty((0,) + new_pop.shape[1:], new_pop.dtype)
+            else:
+                self._individuals = np.empty(0, dtype=object)
+        elif self._individuals.dtype != object:
+            if isinstance(new_pop, np.ndarray):
+                new_dtype = new_pop.dtype
+            else:
+                new_dtype = np.asarray(new_pop[0]).dtype
+            new_dtype = np.result_type(self._individuals.dtype, new_dtype)
+            if new_dtype != self._individuals.dtype:
+                self._individuals = self._individuals.astype(new_dtype)
+        required = self._size + num_new
+        if required <= self._capacity:
+            return
+        capacity = max(required, 2 * self._capacity)
+        for name in (
+            "_individuals",
+            "_objectives",
+            "_fitness",
+            "_constraint_violation",
+        ):
+            old = getattr(self, name)
+            buffer = np.empty((capacity,) + old.shape[1:], old.dtype)
+            buffer[: self._size] = old[: self._size]
+            setattr(self, name, buffer)
+        self._capacity = capacity
+
+    def _append(self, new_pop, obj, CV, fitness):
+        """Append evaluated individuals to the buffers.
+
+        Parameters
+        ----------
+        new_pop: array_like
+            Individuals to append.
+        obj, CV, fitness: np.ndarray
+            Objective values, constraint violation and fitness of the individuals,
+            one row per individual.
+        """
+        num_new = len(obj)
+        self._reserve(num_new, new_pop)
+        start, stop = self._size, self._size + num_new
+        if self._individuals.dtype == object:
+            # Assign one by one so that numpy does not try to broadcast the contents
+            # of the individuals.
+            for i, ind in enumerate(new_pop):
+                self._individuals[start + i] = ind
+        else:
+            self._individuals[start:stop] = new_pop
+        self._objectives[start:stop] = obj
+        self._constraint_violation[start:stop] = CV
+        self._fitness[start:stop] = fitness
+        self._size = stop
+        self._add_to_front(start)
+
+    def _add_to_front(self, start: int):
+        """Update the non-dominated front with the individuals from index start on.
+
+        Only the new individuals are compared with the current front.
+
+        Parameters
+        ----------
+        start: int
+            Index of the first new individual.
+        """
+        if self._front is None:
+            return
+        obj = self.objectives
+        candidates = start + non_dominated_front(obj[start:])
+        candidates = candidates[~is_dominated_by(obj[candidates], obj[self._front])]
+        front = self._front[~is_dominated_by(obj[self._front], obj[candidates])]
+        # The new individuals come last, so the front stays sorted
+        self._front = np.concatenate((front, candidates))
+
+    def _delete_from_front(self, mask):
+        """Update the non-dominated front after deleting individuals.
+
+        The remaining front members stay non-dominated. If front members were
+        deleted, the individuals they dominated are checked against the remaining
+        front.
+
+        Parameters
+        ----------
+        mask: np.ndarray
+            True for the individuals which were kept, before deleting.
+        """
+        if self._front is None:
+            return
+        new_index = np.cumsum(mask) - 1
+        kept = mask[self._front]
+        front = new_index[self._front[kept]]
+        if np.all(kept):
+            self._front = front
+            return
+        obj = self.objectives
+        others = np.ones(self._size, dtype=bool)
+        others[front] = False
+        others = np.flatnonzero(others)
+        others = others[~is_dominated_by(obj[others], obj[front])]
+        candidates = others[non_dominated_front(obj[others])]
+        self._front = np.sort(np.concatenate((front, candidates)))
+
     def add(self, new_pop: list):
         """Evaluate and add individuals to the population. Update ideal and nadir point.
 
+        The new individuals are evaluated together with one call to
+        problem.evaluate_batch, and appended to the population at once.
+
         Parameters
         ----------
         new_pop: list
             Decision variable values for new population.
         """
-        for i in range(len(new_pop)):
-            self.append_individual(new_pop[i])
+        if len(new_pop) == 0:
+            self.update_ideal_and_nadir()
+            return
+        obj, CV, fitness = self.evaluate_individuals(new_pop)
+        self._append(new_pop, obj, CV, fitness)
 
-        self.update_ideal_and_nadir()
+        self.update_ideal_and_nadir(fitness)
 
     def append_individual(self, ind: np.ndarray):
         """Evaluate and add individual to the population.
@@ -145,11 +350,16 @@ class Population:
         ind: np.ndarray
         """
 
-        self.individuals.append(ind)
         obj, CV, fitness = self.evaluate_individual(ind)
-        self.objectives = np.vstack((self.objectives, obj))
-        self.constraint_violation = np.vstack((self.constraint_violation, CV))
-        self.fitness = np.vstack((self.fitness, fitness))
+        new_pop = [ind]
+        if isinstance(ind, np.ndarray) and ind.dtype != object:
+            new_pop = ind[np.newaxis]
+        self._append(
+            new_pop,
+            np.reshape(obj, (1, -1)),
+            np.reshape(CV, (1, -1)),
+            np.reshape(fitness, (1, -1)),
+        )
 
     def evaluate_individual(self, ind: np.ndarray):
         """Evaluate individual.
@@ -170,9 +380,38 @@ class Population:
 
         return obj, CV, fitness
 
+    def evaluate_individuals(self, new_pop):
+        """Evaluate a batch of individuals.
+
+        Returns objective values, constraint violation, and fitness, each with one
+        row per individual.
+
+        Parameters
+        ----------
+        new_pop: array_like
+            Individuals to evaluate.
+        """
+        obj = self.evaluator.evaluate(self.problem, new_pop)
+        fitness = self.eval_fitness(obj)
+        if self.problem.num_of_constraints:
+            CV = np.asarray(
+                [
+                    self.problem.constraints(ind, ind_obj)
+                    for ind, ind_obj in zip(new_pop, obj)
+                ],
+                dtype=float,
+            ).reshape(len(obj), -1)
+        else:
+            CV = np.empty((len(obj), 0), float)
+
+        return obj, CV, fitness
+
     def eval_fitness(self, obj):
         """
         Calculate fitness based on objective values. Fitness = obj if minimized.
+
+        obj can be the objective values of one individual, or a 2D array with the
+        objective values of many individuals on its rows.
         """
 
         # fitness = self.objectives * self.problem.objs
@@ -181,7 +420,7 @@ class Population:
         else:
             assert len(self.problem.minimize) == self.problem.num_of_objectives
 
-        fitness = np.asarray(obj)[np.asarray(self.problem.minimize)]
+        fitness = np.asarray(obj)[..., np.asarray(self.problem.minimize)]
 
         return fitness
 
@@ -199,6 +438,9 @@ class Population:
         """Remove from population individuals which are in indices if preserve=False,
         otherwise preserve them and remove all others.
 
+        The remaining individuals are compacted in place to the start of the
+        population buffers, keeping their order.
+
         Parameters
         ----------
         indices: array_like
@@ -208,41 +450,69 @@ class Population:
             preserve them and delete others.
         """
 
-        mask = np.ones(len(self.individuals), dtype=bool)
+        mask = np.ones(self._size, dtype=bool)
         mask[indices] = False
+        if preserve:
+            mask = ~mask
+        keep = np.flatnonzero(mask)
+        num_keep = len(keep)
+
+        for buffer in (
+            self._individuals,
+            self._objectives,
+            self._fitness,
+            self._constraint_violation,
+        ):
+            if buffer is None:
+                continue
+            buffer[:num_keep] = buffer[keep]
+        if self._individuals is not None and self._individuals.dtype == object:
+            # Release the references to the removed individuals
+            self._individuals[num_keep : self._size] = None
+        self._size = num_keep
+        self._delete_from_front(mask)
+
+    def reevaluate(self):
+        """Evaluate all individuals again, and recalculate the ideal and nadir point.
+
+        Used when the objectives of the problem have changed, e.g. when they are
+        calculated on a new subsample of the data.
+        """
+        if self._size == 0:
+            return
+        # Pool workers may hold a copy of the problem from before the change
+        self.close()
+        obj, CV, fitness = self.evaluate_individuals(self.individuals)
+        self._objectives[: self._size] = obj
+        self._constraint_violation[: self._size] = CV
+        self._fitness[: self._size] = fitness
+        self._front = None
+        self.ideal_fitness = np.full((1, self._fitness.shape[1]), np.inf)
+        self.worst_fitness = -1 * self.ideal_fitness
+        self.update_ideal_and_nadir()
 
-        new_pop = np.array(self.individuals)[mask]
-        deleted_pop = np.array(self.individuals)[~mask]
-
-        new_obj = self.objectives[mask]
-        deleted_obj = self.objectives[~mask]
-
-        new_fitness = self.fitness[mask]
-        deleted_fitness = self.fitness[~mask]
+    def close(self):
+        """Release the resources of the evaluator, e.g. shut down its workers.
 
-        if len(self.constraint_violation) > 0:
-            new_cv = self.constraint_violation[mask]
-            deleted_cv = self.constraint_violation[~mask]
-        else:
-            deleted_cv = self.constraint_violation
-            new_cv = self.constraint_violation
+        The workers are started again if individuals are evaluated later. The
+        population can also be used as a context manager which calls close on exit.
+        """
+        close = getattr(self.evaluator, "close", None)
+        if close is not None:
+            close()
 
-        if not preserve:
-            self.individuals = list(new_pop)
-            self.objectives = new_obj
-            self.fitness = new_fitness
-            self.constraint_violation = new_cv
+    def __enter__(self):
+        return self
 
-        else:
-            self.individuals = list(deleted_pop)
-            self.objectives = deleted_obj
-            self.fitness = deleted_fitness
-            self.constraint_violation = deleted_cv
+    def __exit__(self, *exc_info):
+        self.close()
 
     def evolve(self, EA: "BaseEA" = None, ea_parameters: dict = None):
         """Evolve the population with interruptions.
 
-        Evolves the population based on the EA sent by the user.
+        Evolves the population based on the EA sent by the user. Before each
+        iteration, problem.start_iteration is called, and the population is evaluated
+        again if the problem reports that its objectives changed.
 
         Parameters
         ----------
@@ -267,11 +537,16 @@ class Population:
 
         if self.plotting:
             self.plot_objectives()  # Figure was created in init
-        for i in progressbar(range(iterations), desc="Iteration"):
-            ea._run_interruption(self)
-            ea._next_iteration(self)
-            if self.plotting:
-                self.plot_objectives()
+        try:
+            for i in progressbar(range(iterations), desc="Iteration"):
+                if self.problem.start_iteration(i, iterations):
+                    self.reevaluate()
+                ea._run_interruption(self)
+                ea._next_iteration(self)
+                if self.plotting:
+                    self.plot_objectives()
+        finally:
+            self.close()
 
     def mate(self, mating_pop=None, params=None):
         """Conduct crossover and mutation over the population.
@@ -382,25 +657,31 @@ class Population:
             num_obj = non_dom.shape[1]
             ref_point = [ref_point] * num_obj
         non_dom = non_dom[np.all(non_dom < ref_point, axis=1), :]
+        from pygmo import hypervolume as hv
+
         hyp = hv(non_dom)
         self.hyp = hyp.compute(ref_point)
         return self.hyp
 
     def non_dominated(self):
-        """Fix this. check if nd2 and nds mean the same thing"""
-        obj = self.objectives
-        num_obj = obj.shape[1]
-        if num_obj == 2:
-            non_dom_front = nd2(obj)
-        else:
-            non_dom_front = nds(obj)
-        if isinstance(non_dom_front, tuple):
-            self.non_dom = self.objectives[non_dom_front[0][0]]
-        elif isinstance(non_dom_front, np.ndarray):
-            self.non_dom = self.objectives[non_dom_front]
-        else:
-            print("Non Dom error Line 285 in population.py")
-        return non_dom_front
+        """Return the indices of the non-dominated individuals of the population.
+
+        The front is maintained incrementally when individuals are added or deleted,
+        so this is cheap to call every generation. Do not modify the returned array.
+
+        Returns
+        -------
+        np.ndarray
+            Sorted indices of the non-dominated individuals.
+        """
+        if self._front is None:
+            self._front = non_dominated_front(self.objectives)
+        return self._front
+
+    @property
+    def non_dom(self):
+        """Objective values of the non-dominated individuals."""
+        return self.objectives[self.non_dominated()]
 
     def update_ideal_and_nadir(self, new_objective_vals: list = None):
         """Updates self.ideal and self.nadir in the fitness space.
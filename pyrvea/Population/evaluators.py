@@ -0,0 +1,300 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from math import ceil
+from os import cpu_count
+
+import numpy as np
+
+
+class EvaluationError(Exception):
+    """Raised when the objectives of an individual could not be calculated.
+
+    Parameters
+    ----------
+    index : int
+        Index of the failed individual in the evaluated batch.
+    message : str
+        Description of the original error.
+    """
+
+    def __init__(self, index, message):
+        super().__init__(index, message)
+        self.index = index
+        self.message = message
+
+    def __str__(self):
+        return "Evaluation of individual {} failed: {}".format(
+            self.index, self.message
+        )
+
+
+def _evaluate_chunk(problem, start, individuals):
+    """Calculate the objectives of consecutive individuals of a batch.
+
+    Parameters
+    ----------
+    problem : BaseProblem
+        The problem to evaluate.
+    start : int
+        Index of the first individual of the chunk in the whole batch.
+    individuals : array_like
+        The individuals of the chunk.
+
+    Returns
+    -------
+    list
+        Objective values of each individual.
+    """
+    objectives = []
+    for offset, ind in enumerate(individuals):
+        try:
+            objectives.append(problem.objectives(ind))
+        except Exception as e:
+            raise EvaluationError(start + offset, repr(e)) from e
+    return objectives
+
+
+def _evaluate_batch(problem, start, individuals):
+    """Calculate the objectives of consecutive individuals of a batch with
+    problem.evaluate_batch.
+
+    If the batch fails, the individuals are evaluated one by one to find the
+    failing individual. Problems whose objectives modify the individuals are always
+    evaluated one by one, so that no individual is evaluated twice.
+
+    Parameters
+    ----------
+    problem : BaseProblem
+        The problem to evaluate.
+    start : int
+        Index of the first individual of the chunk in the whole batch.
+    individuals : array_like
+        The individuals of the chunk.
+
+    Returns
+    -------
+    np.ndarray
+        Objective values, one row per individual.
+
+    Raises
+    ------
+    EvaluationError
+        If the evaluation of an individual fails.
+    """
+    if getattr(problem, "modifies_individuals", False):
+        objectives = _evaluate_chunk(problem, start, individuals)
+        return np.asarray(objectives, dtype=float).reshape(len(objectives), -1)
+    try:
+        return problem.evaluate_batch(individuals)
+    except EvaluationError:
+        raise
+    except Exception:
+        # Raises EvaluationError with the index of the failing individual. If each
+        # individual succeeds alone, the original error is raised.
+        _evaluate_chunk(problem, start, individuals)
+        raise
+
+
+# Problem evaluated by a worker process of ProcessPoolEvaluator, set once when the
+# worker starts
+_worker_problem = None
+
+
+def _init_worker(problem):
+    """Store the problem in a worker process of ProcessPoolEvaluator."""
+    global _worker_problem
+    _worker_problem = problem
+
+
+def _evaluate_in_worker(start, individuals):
+    """Evaluate a chunk of individuals with the problem of the worker process."""
+    return _evaluate_batch(_worker_problem, start, individuals)
+
+
+class SerialEvaluator:
+    """Evaluate individuals in the calling process with problem.evaluate_batch.
+
+    If the evaluation of an individual fails, EvaluationError with the index of the
+    individual is raised.
+    """
+
+    def evaluate(self, problem, individuals):
+        """Calculate the objective values of individuals.
+
+        Parameters
+        ----------
+        problem : BaseProblem
+            The problem to evaluate.
+        individuals : array_like
+            The individuals to evaluate.
+
+        Returns
+        -------
+        np.ndarray
+            Objective values, one row per individual.
+        """
+        return _evaluate_batch(problem, 0, individuals)
+
+    def close(self):
+        """Release the resources of the evaluator."""
+        pass
+
+
+class PoolEvaluator(SerialEvaluator):
+    """Evaluate individuals concurrently in a pool of workers.
+
+    The individuals are split in chunks which are sent to the workers. Each chunk
+    is evaluated with problem.evaluate_batch. The order of the objective values
+    matches the order of the individuals. If the evaluation of an individual fails,
+    EvaluationError with the index of the individual is raised.
+
+    Parameters
+    ----------
+    max_workers : int, optional
+        Number of workers. If None, the number of CPUs is used.
+    chunksize : int, optional
+        Number of individuals sent to a worker at once. If None, each batch is split
+        into about four chunks per worker.
+    """
+
+    executor_class = None
+
+    def __init__(self, max_workers=None, chunksize=None):
+        self.max_workers = max_workers or cpu_count() or 1
+        self.chunksize = chunksize
+        self.executor = None
+        self.problem = None
+
+    def _start(self, problem):
+        """Start the workers for evaluating problem."""
+        self.executor = self.executor_class(max_workers=self.max_workers)
+
+    def _submit(self, problem, start, individuals):
+        """Send a chunk of individuals to the workers."""
+        return self.executor.submit(_evaluate_batch, problem, start, individuals)
+
+    def evaluate(self, problem, individuals):
+        """Calculate the objective values of individuals.
+
+        Parameters
+        ----------
+        problem : BaseProblem
+            The problem to evaluate.
+        individuals : array_like
+            The individuals to evaluate.
+
+        Returns
+        -------
+        np.ndarray
+            Objective values, one row per individual.
+        """
+        num_individuals = len(individuals)
+        if num_individuals == 0:
+            return _evaluate_batch(problem, 0, individuals)
+        if self.executor is None or problem is not self.problem:
+            self.close()
+            self._start(problem)
+            self.problem = problem
+        chunksize = self.chunksize
+        if chunksize is None:
+            chunksize = max(1, ceil(num_individuals / (4 * self.max_workers)))
+        futures = [
+            self._submit(problem, start, individuals[start : start + chunksize])
+            for start in range(0, num_individuals, chunksize)
+        ]
+        objectives = []
+        try:
+            for future in futures:
+                objectives.append(np.asarray(future.result(), dtype=float))
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+        return np.concatenate(objectives).reshape(num_individuals, -1)
+
+    def close(self):
+        """Shut down the workers. They are started again by the next evaluate."""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+            self.problem = None
+
+
+class ProcessPoolEvaluator(PoolEvaluator):
+    """Evaluate individuals in a pool of processes.
+
+    Suited for expensive objectives which hold the GIL. The problem is pickled once
+    for each worker when the pool is started, and the individuals for each chunk, so
+    changes the objectives make to them are not seen by the population. Therefore
+    problems with modifies_individuals set can not be evaluated. Changes made
+    to the problem in the calling process are not seen by the workers until the pool
+    is restarted with close, which Population does when the objectives of the
+    problem change.
+    """
+
+    executor_class = ProcessPoolExecutor
+
+    def _start(self, problem):
+        self.executor = self.executor_class(
+            max_workers=self.max_workers,
+            initializer=_init_worker,
+            initargs=(problem,),
+        )
+
+    def _submit(self, problem, start, individuals):
+        return self.executor.submit(_evaluate_in_worker, start, individuals)
+
+
+class ThreadPoolEvaluator(PoolEvaluator):
+    """Evaluate individuals in a pool of threads.
+
+    Suited for objectives which release the GIL, e.g. external simulators or
+    NumPy heavy calculations. The objectives of the problem are called from several
+    threads at once, so any state they share between calls must be guarded. The
+    caches of EvoNN, EvoDN2 and BioGP (ArrayCache and GramCache) hold locks while
+    they are used.
+    """
+
+    executor_class = ThreadPoolExecutor
+
+
+def get_evaluator(evaluator=None, options=None, problem=None):
+    """Return an evaluator object.
+
+    Parameters
+    ----------
+    evaluator : str or object, optional
+        "serial" (default), "process" or "thread", or an object with an
+        evaluate(problem, individuals) method, which is returned as is.
+    options : dict, optional
+        Keyword arguments of the evaluator given by name, e.g. max_workers and
+        chunksize of the pools.
+    problem : BaseProblem, optional
+        The problem to evaluate. Used to check that the evaluator can evaluate it.
+
+    Returns
+    -------
+    The evaluator.
+
+    Raises
+    ------
+    ValueError
+        If the objectives of problem modify the individuals and the evaluator
+        evaluates them in other processes.
+    """
+    evaluator_options = {
+        "serial": SerialEvaluator,
+        "process": ProcessPoolEvaluator,
+        "thread": ThreadPoolEvaluator,
+    }
+    if evaluator is None:
+        evaluator = "serial"
+    if isinstance(evaluator, str):
+        evaluator = evaluator_options[evaluator](**(options or {}))
+    if isinstance(evaluator, ProcessPoolEvaluator) and getattr(
+        problem, "modifies_individuals", False
+    ):
+        raise ValueError(
+            "The objectives of {} modify the individuals, so they can not be "
+            "evaluated in other processes".format(type(problem).__name__)
+        )
+    return evaluator
@@ -1,6 +1,13 @@
+import numpy as np
+
+
 class BaseProblem:
     """Base class for the problems."""
 
+    # True if the objectives change the individuals they evaluate, e.g. by storing
+    # results in them. Such problems can not be evaluated in other processes.
+    modifies_individuals = False
+
     def __init__(
         self,
         name=None,
@@ -46,6 +53,47 @@ class BaseProblem:
         """
         pass
 
+    def evaluate_batch(self, decision_variables):
+        """Accept a batch of samples. Return objective values of all samples.
+
+        The default implementation calls objectives once per sample. Override it if
+        the objectives can be calculated for the whole batch at once.
+
+        Parameters
+        ----------
+        decision_variables : array_like
+            Samples to evaluate, one per row (or one per element for individuals
+            which are not arrays).
+
+        Returns
+        -------
+        np.ndarray
+            Objective values, shape (number of samples, number of objectives).
+        """
+        objectives = [self.objectives(sample) for sample in decision_variables]
+        return np.asarray(objectives, dtype=float).reshape(len(objectives), -1)
+
+    def start_iteration(self, iteration, iterations):
+        """Called by Population.evolve before each iteration of the evolution.
+
+        Problems whose objectives change between iterations, e.g. because they are
+        calculated on a subsample of the data, make the change here.
+
+        Parameters
+        ----------
+        iteration : int
+            Index of the iteration about to start.
+        iterations : int
+            Total number of iterations.
+
+        Returns
+        -------
+        bool
+            True if the objectives changed, so that the population must be
+            evaluated again.
+        """
+        return False
+
     def constraints(self, decision_variables, objective_variables):
         """Accept a sample and/or corresponding objective values.
 
@@ -0,0 +1,382 @@
+from random import random, randrange
+
+import numpy as np
+
+from pyrvea.Problem.biogp_program import TreeProgram, fit_linear, training_error
+
+# Opcode of constant terminals. Opcodes from 0 up are indices into the function
+# set, and variable terminals have opcode -2 - (index into the terminal set).
+_CONSTANT = -1
+
+
+class ArrayTree:
+    """A BioGP individual stored as arrays, an alternative to a tree of LinearNode
+    and Node objects.
+
+    The subtrees under the linear node are stored one after another in prefix
+    order, one array element per node. A subtree is a contiguous slice of the
+    arrays starting at its root, so crossover and mutation are splices of the
+    arrays. The arrays are never changed in place, which makes copying an
+    individual cheap: copies share the arrays until they are changed.
+
+    Parameters
+    ----------
+    params : dict
+        Parameters of the model, shared by the population.
+    opcodes : np.ndarray
+        Function or terminal of each node.
+    constants : np.ndarray
+        Value of each constant terminal, 0 for other nodes.
+    sizes : np.ndarray
+        Number of nodes in the subtree under each node, including the node.
+    depths : np.ndarray
+        Depth of each node. The roots of the subtrees are at depth 1.
+
+    Attributes
+    ----------
+    linear : np.ndarray
+        The bias and the weights of the subtrees.
+    complexity : float
+        Complexity of the tree.
+    """
+
+    def __init__(self, params, opcodes, constants, sizes, depths):
+        self.params = params
+        self.linear = None
+        self.complexity = None
+        self._set_arrays(opcodes, constants, sizes, depths)
+
+    @classmethod
+    def grow(cls, params, max_depth=None, method="grow"):
+        """Create a random tree with params["max_subtrees"] subtrees.
+
+        Parameters
+        ----------
+        params : dict
+            Parameters of the model.
+        max_depth : int
+            The maximum depth of the tree.
+        method : str
+            "grow" or "full", see Node.grow_tree.
+
+        Returns
+        -------
+        ArrayTree
+            The new tree.
+        """
+        subtrees = [
+            grow_subtree(params, max_depth, method)
+            for _ in range(params["max_subtrees"])
+        ]
+        return cls(params, *(np.concatenate(arrays) for arrays in zip(*subtrees)))
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def _set_arrays(self, opcodes, constants, sizes, depths):
+        self.opcodes = opcodes
+        self.constants = constants
+        self.sizes = sizes
+        self.depths = depths
+        self._program = None
+
+    @property
+    def total_depth(self):
+        """Depth of the deepest node."""
+        return int(self.depths.max()) if len(self.depths) else 0
+
+    @property
+    def num_function_nodes(self):
+        """Number of function nodes in the tree."""
+        return int(np.count_nonzero(self.opcodes >= 0))
+
+    def roots(self):
+        """Indices of the roots of the subtrees under the linear node."""
+        return np.flatnonzero(self.depths == 1)
+
+    def copy(self):
+        """Copy the tree. The copy shares the arrays and the compiled program."""
+        tree = ArrayTree.__new__(ArrayTree)
+        tree.__dict__.update(self.__dict__)
+        return tree
+
+    def subtree(self, index):
+        """Arrays of the subtree under a node.
+
+        Parameters
+        ----------
+        index : int
+            Index of the root of the subtree.
+
+        Returns
+        -------
+        tuple
+            opcodes, constants, sizes and depths of the subtree.
+        """
+        end = index + self.sizes[index]
+        return (
+            self.opcodes[index:end],
+            self.constants[index:end],
+            self.sizes[index:end],
+            self.depths[index:end],
+        )
+
+    def replace(self, index, subtree):
+        """Replace the subtree under a node.
+
+        Parameters
+        ----------
+        index : int
+            Index of the root of the subtree to replace.
+        subtree : tuple
+            opcodes, constants, sizes and depths of the new subtree, as returned by
+            subtree or grow_subtree. The depths are shifted to the depth of the
+            replaced node.
+        """
+        opcodes, constants, sizes, depths = subtree
+        end = index + self.sizes[index]
+        # The subtrees of the ancestors of the node change size
+        before = np.arange(index)
+        ancestors = before[before + self.sizes[:index] > index]
+        new_sizes = np.concatenate((self.sizes[:index], sizes, self.sizes[end:]))
+        new_sizes[ancestors] += len(opcodes) - (end - index)
+        self._set_arrays(
+            np.concatenate((self.opcodes[:index], opcodes, self.opcodes[end:])),
+            np.concatenate((self.constants[:index], constants, self.constants[end:])),
+            new_sizes,
+            np.concatenate(
+                (
+                    self.depths[:index],
+                    depths - depths[0] + self.depths[index],
+                    self.depths[end:],
+                )
+            ),
+        )
+
+    def crossover(self, other, index, other_index):
+        """Swap subtrees between two trees.
+
+        Parameters
+        ----------
+        other : ArrayTree
+            The other parent.
+        index : int
+            Index of the subtree to swap in this tree.
+        other_index : int
+            Index of the subtree to swap in the other tree.
+
+        Returns
+        -------
+        tuple
+            The two offspring. The parents are not changed.
+        """
+        offspring1 = self.copy()
+        offspring1.replace(index, other.subtree(other_index))
+        offspring2 = other.copy()
+        offspring2.replace(other_index, self.subtree(index))
+        return offspring1, offspring2
+
+    def swap(self, index1, index2):
+        """Swap two subtrees within the tree.
+
+        Nothing is done if one of the subtrees contains the other.
+
+        Parameters
+        ----------
+        index1, index2 : int
+            Indices of the roots of the subtrees.
+        """
+        first, second = sorted((index1, index2))
+        if second < first + self.sizes[first]:
+            return
+        first_subtree = self.subtree(first)
+        second_subtree = self.subtree(second)
+        # Replace the later subtree first, so that the index of the earlier one
+        # stays valid
+        self.replace(second, first_subtree)
+        self.replace(first, second_subtree)
+
+    def point_mutation(self, prob_replace):
+        """Replace nodes with random functions of the same arity or terminals.
+
+        Parameters
+        ----------
+        prob_replace : float
+            Probability of replacing each node.
+        """
+        functions = self.params["function_set"]
+        terminals = self.params["terminal_set"]
+        opcodes = self.opcodes.copy()
+        constants = self.constants.copy()
+        replace = np.random.rand(len(opcodes)) < prob_replace
+
+        arities = np.array([function.__code__.co_argcount for function in functions])
+        function_nodes = np.flatnonzero(replace & (opcodes >= 0))
+        for arity in np.unique(arities[opcodes[function_nodes]]):
+            nodes = function_nodes[arities[opcodes[function_nodes]] == arity]
+            candidates = np.flatnonzero(arities == arity)
+            choices = np.random.randint(len(candidates), size=len(nodes))
+            opcodes[nodes] = candidates[choices]
+
+        terminal_nodes = np.flatnonzero(replace & (opcodes < 0))
+        new_terminals = np.random.randint(len(terminals), size=len(terminal_nodes))
+        for node, terminal in zip(terminal_nodes.tolist(), new_terminals.tolist()):
+            opcodes[node], constants[node] = _encode_terminal(terminals, terminal)
+
+        self._set_arrays(opcodes, constants, self.sizes, self.depths)
+
+    def prefix(self):
+        """Generate (value, arity) of the nodes in prefix order, see TreeProgram."""
+        functions = self.params["function_set"]
+        terminals = self.params["terminal_set"]
+        for opcode, constant in zip(self.opcodes.tolist(), self.constants.tolist()):
+            if opcode >= 0:
+                function = functions[opcode]
+                yield function, function.__code__.co_argcount
+            elif opcode == _CONSTANT:
+                yield constant, 0
+            else:
+                yield terminals[-2 - opcode], 0
+
+    def program(self):
+        """Get the subtrees compiled into a postfix program.
+
+        Returns
+        -------
+        TreeProgram
+            The compiled subtrees.
+        """
+        if self._program is None:
+            self._program = TreeProgram.from_prefix(self.prefix(), len(self.roots()))
+        return self._program
+
+    def predict(self, decision_variables=None):
+        """Predict using the weighted sum of the subtrees.
+
+        Parameters
+        ----------
+        decision_variables : pd.DataFrame or np.ndarray
+            The data, one sample per row.
+
+        Returns
+        -------
+        np.ndarray
+            The prediction.
+        """
+        return np.dot(self.program().run(decision_variables), self.linear)
+
+    def calculate_linear(self, X_train, y_train, cache=None):
+        """Fit the weights of the subtrees and calculate the objectives.
+
+        Subtrees whose error reduction ratio is below error_lim are replaced by new
+        random subtrees.
+
+        Parameters
+        ----------
+        X_train : pd.DataFrame or np.ndarray
+            Training data input.
+        y_train : pd.DataFrame or np.ndarray
+            Training data target values.
+        cache : ArrayCache or None
+            Cache of subtree outputs calculated from X_train.
+
+        Returns
+        -------
+        list
+            The training error and the complexity of the tree.
+        """
+        sub_trees = self.program().run(X_train, cache)
+        y_train = np.asarray(y_train)
+        weights, out, error = fit_linear(sub_trees, y_train)
+        self.linear = weights
+
+        # Delete the subtrees whose error reduction ratio < err_lim and grow new ones
+        weak = self.roots()[error < self.params["error_lim"]]
+        if len(weak) > 0:
+            keep = np.ones(len(self), dtype=bool)
+            for root in weak.tolist():
+                keep[root : root + self.sizes[root]] = False
+            arrays = (self.opcodes, self.constants, self.sizes, self.depths)
+            subtrees = [tuple(array[keep] for array in arrays)]
+            subtrees.extend(
+                grow_subtree(self.params, method="grow") for _ in range(len(weak))
+            )
+            self._set_arrays(*(np.concatenate(arrays) for arrays in zip(*subtrees)))
+
+        self.complexity = (
+            self.params["complexity_scalar"] * self.total_depth
+            + (1 - self.params["complexity_scalar"]) * self.num_function_nodes
+        )
+
+        return [training_error(y_train, out, self.params["loss_func"]), self.complexity]
+
+
+def grow_subtree(params, max_depth=None, method="grow", depth=1):
+    """Create a random subtree with the grow or full method, see Node.grow_tree.
+
+    Parameters
+    ----------
+    params : dict
+        Parameters of the model.
+    max_depth : int
+        The maximum depth of the tree.
+    method : str
+        "grow" or "full".
+    depth : int
+        Depth of the root of the subtree.
+
+    Returns
+    -------
+    tuple
+        opcodes, constants, sizes and depths of the subtree.
+    """
+    if max_depth is None:
+        max_depth = params["max_depth"]
+    functions = params["function_set"]
+    terminals = params["terminal_set"]
+    opcodes = []
+    constants = []
+    sizes = []
+    depths = []
+    # Nodes whose subtrees are being grown, with the number of children left
+    pending = []
+    while True:
+        index = len(opcodes)
+        depths.append(depth)
+        sizes.append(1)
+        if (
+            depth >= max_depth
+            or method == "grow"
+            and random() < params["prob_terminal"]
+        ):
+            opcode, constant = _encode_terminal(terminals, randrange(len(terminals)))
+            opcodes.append(opcode)
+            constants.append(constant)
+            # Close the subtrees completed by the terminal
+            while pending and pending[-1][1] == 1:
+                start, _ = pending.pop()
+                sizes[start] = len(opcodes) - start
+            if not pending:
+                break
+            pending[-1][1] -= 1
+            depth = depths[pending[-1][0]] + 1
+        else:
+            function = randrange(len(functions))
+            opcodes.append(function)
+            constants.append(0.0)
+            pending.append([index, functions[function].__code__.co_argcount])
+            depth += 1
+    return (
+        np.array(opcodes, dtype=np.int32),
+        np.array(constants, dtype=float),
+        np.array(sizes, dtype=np.int32),
+        np.array(depths, dtype=np.int32),
+    )
+
+
+def _encode_terminal(terminals, terminal):
+    """Opcode and constant of a terminal, given its index in the terminal set."""
+    value = terminals[terminal]
+    if isinstance(value, str):
+        return -2 - terminal, 0.0
+    return _CONSTANT, float(value)
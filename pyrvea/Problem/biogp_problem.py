@@ -1,3 +1,4 @@
+from copy import deepcopy
 from math import ceil
 from random import choice, random
 
@@ -9,8 +10,15 @@ from graphviz import Digraph, Source
 
 from pyrvea.EAs.PPGA import PPGA
 from pyrvea.EAs.TournamentEA import TournamentEA
+from pyrvea.OtherTools.array_cache import ArrayCache
 from pyrvea.Population.Population import Population
 from pyrvea.Problem.baseproblem import BaseProblem
+from pyrvea.Problem.biogp_array_tree import ArrayTree
+from pyrvea.Problem.biogp_program import TreeProgram, fit_linear, training_error
+from pyrvea.Problem.subsampling import Subsampler
+
+# Operators working on ArrayTrees, used instead of the ones working on Node trees
+_ARRAY_OPERATORS = {"biogp_xover": "biogp_array_xover", "biogp_mut": "biogp_array_mut"}
 
 
 class BioGP(BaseProblem):
@@ -68,6 +76,10 @@ class BioGP(BaseProblem):
     Applied Soft Computing, 13(5), 2613-2623.
     """
 
+    # calculate_linear stores the weights, outputs and complexity in the tree and
+    # regrows its weak subtrees
+    modifies_individuals = True
+
     def __init__(
         self,
         name=None,
@@ -104,6 +116,10 @@ class BioGP(BaseProblem):
         self.function_set = function_set
 
         self.individuals = []
+        self.subsampler = None
+        self._iteration_offset = 0
+        self._final_phase = True
+        self.subtree_cache = None
 
     def create_individuals(self):
 
@@ -115,35 +131,83 @@ class BioGP(BaseProblem):
                     int(self.params["pop_size"] / (self.params["max_depth"] + 1))
                 ):
 
-                    ind = LinearNode(value="linear", params=self.params)
-                    ind.grow_tree(max_depth=md, method="grow", ind=ind)
+                    ind = self.grow_individual(max_depth=md, method="grow")
                     self.individuals.append(ind)
 
                 for i in range(
                     int(self.params["pop_size"] / (self.params["max_depth"] + 1))
                 ):
 
-                    ind = LinearNode(value="linear", params=self.params)
-                    ind.grow_tree(max_depth=md, method="full", ind=ind)
+                    ind = self.grow_individual(max_depth=md, method="full")
                     self.individuals.append(ind)
 
         elif self.params["init_method"] == "full":
             for i in range(self.params["pop_size"]):
-                ind = LinearNode(value="linear", params=self.params)
-                ind.grow_tree(method="full", ind=ind)
+                ind = self.grow_individual(method="full")
                 self.individuals.append(ind)
 
         elif self.params["init_method"] == "grow":
             for i in range(self.params["pop_size"]):
-                ind = LinearNode(value="linear", params=self.params)
-                ind.grow_tree(method="grow", ind=ind)
+                ind = self.grow_individual(method="grow")
                 self.individuals.append(ind)
 
         return self.individuals
 
+    def grow_individual(self, max_depth=None, method="grow"):
+        """Create a random individual in the representation set in params.
+
+        Parameters
+        ----------
+        max_depth : int
+            The maximum depth of the tree.
+        method : str
+            "grow" or "full", see Node.grow_tree.
+
+        Returns
+        -------
+        LinearNode or ArrayTree
+            The new individual.
+        """
+        if self.params.get("representation", "node") == "array":
+            return ArrayTree.grow(self.params, max_depth=max_depth, method=method)
+        ind = LinearNode(value="linear", params=self.params)
+        ind.grow_tree(max_depth=max_depth, method=method, ind=ind)
+        return ind
+
     def objectives(self, decision_variables):
 
-        return decision_variables.calculate_linear(self.X_train, self.y_train)
+        return decision_variables.calculate_linear(
+            self.X_train, self.y_train, self.subtree_cache
+        )
+
+    def start_iteration(self, iteration, iterations):
+        """Switch to the training data of the iteration if subsampling is used.
+
+        Parameters
+        ----------
+        iteration : int
+            Index of the iteration about to start.
+        iterations : int or None
+            Total number of iterations, or None before the evolution starts.
+
+        Returns
+        -------
+        bool
+            True if the training data changed.
+        """
+        if self.subsampler is None:
+            return False
+        # Both phases of train follow one schedule, so the full data is only used
+        # at the end of the bi-objective phase
+        iteration += self._iteration_offset
+        if self._final_phase and iterations is not None:
+            iterations += self._iteration_offset
+        else:
+            iterations = None
+        changed = self.subsampler.start_iteration(self, iteration, iterations)
+        if changed and self.subtree_cache is not None:
+            self.subtree_cache.clear()
+        return changed
 
     def select(self, pop, non_dom_front, selection="min_error"):
         """ Select target model from the population.
@@ -168,8 +232,8 @@ class BioGP(BaseProblem):
             # Return the model with the lowest error
 
             lowest_error = np.argmin(pop.objectives[:, 0])
-            model = pop.individuals[lowest_error]
-            fitness = pop.fitness[lowest_error]
+            model = deepcopy(pop.individuals[lowest_error])
+            fitness = np.copy(pop.fitness[lowest_error])
 
         return model, fitness
 
@@ -187,8 +251,7 @@ class BioGP(BaseProblem):
 
     @staticmethod
     def div(x, y):
-        y[y == 0] = 1.0
-        return np.divide(x, y)
+        return np.divide(x, np.where(y == 0, 1.0, y))
 
     @staticmethod
     def sqrt(x):
@@ -273,6 +336,10 @@ class BioGPModel(BioGP):
         crossover_type="biogp_xover",
         mutation_type="biogp_mut",
         single_obj_generations=10,
+        subsample_size=None,
+        full_data_iterations=1,
+        subtree_cache_bytes=2 ** 28,
+        representation="node",
         logging=False,
         plotting=False,
         function_set=("add", "sub", "mul", "div"),
@@ -329,6 +396,27 @@ class BioGPModel(BioGP):
             will be handled by the same function. If None, they are done separately.
         single_obj_generations : int
             How many generations to run minimizing only the training error.
+        subsample_size : int or float or None
+            If given, the training error is calculated on rotating subsamples of
+            this many samples (or this fraction of the samples) during the
+            evolution, see pyrvea.Problem.subsampling.Subsampler. None uses the
+            full data throughout.
+        full_data_iterations : int
+            Number of final iterations of the bi-objective phase which use the full
+            data when subsample_size is given. The single objective phase and the
+            bi-objective phase rotate through one schedule of subsamples. The model
+            is always selected on the full data.
+        subtree_cache_bytes : int
+            Maximum size in bytes of the cache of subtree outputs shared by the
+            population during training. Subtrees found in the cache, e.g. ones
+            copied between individuals by crossover, are not evaluated again. 0
+            disables the cache.
+        representation : str
+            How the individuals are stored. "node" (default) uses trees of Node
+            objects. "array" uses pyrvea.Problem.biogp_array_tree.ArrayTree, which
+            stores each individual in a few arrays and is much cheaper to copy. With
+            "array", the default crossover and mutation types are replaced by
+            "biogp_array_xover" and "biogp_array_mut".
         logging : bool
             True to create a logfile, False otherwise.
         plotting : bool
@@ -356,6 +444,10 @@ class BioGPModel(BioGP):
             "crossover_type": crossover_type,
             "mutation_type": mutation_type,
             "single_obj_generations": single_obj_generations,
+            "subsample_size": subsample_size,
+            "full_data_iterations": full_data_iterations,
+            "subtree_cache_bytes": subtree_cache_bytes,
+            "representation": representation,
             "logging": logging,
             "plotting": plotting,
             "function_set": function_set,
@@ -414,6 +506,29 @@ class BioGPModel(BioGP):
         }
         self.minimize = [True, False]
 
+        self.subsampler = None
+        if self.params["subsample_size"]:
+            self.subsampler = Subsampler(
+                self.X_train,
+                self.y_train,
+                self.params["subsample_size"],
+                self.params["full_data_iterations"],
+            )
+        crossover_type = self.params["crossover_type"]
+        mutation_type = self.params["mutation_type"]
+        if self.params.get("representation", "node") == "array":
+            crossover_type = _ARRAY_OPERATORS.get(crossover_type, crossover_type)
+            mutation_type = _ARRAY_OPERATORS.get(mutation_type, mutation_type)
+
+        self.subtree_cache = None
+        if self.params.get("subtree_cache_bytes"):
+            self.subtree_cache = ArrayCache(self.params["subtree_cache_bytes"])
+
+        # The initial population is evaluated on the first subsample
+        self._iteration_offset = 0
+        self._final_phase = False
+        self.start_iteration(0, None)
+
         print(
             "Minimizing error for "
             + str(self.params["single_obj_generations"])
@@ -426,8 +541,8 @@ class BioGPModel(BioGP):
             pop_size=self.params["pop_size"],
             plotting=self.params["plotting"],
             recombination_type=self.params["recombination_type"],
-            crossover_type=self.params["crossover_type"],
-            mutation_type=self.params["mutation_type"],
+            crossover_type=crossover_type,
+            mutation_type=mutation_type,
         )
 
         pop.evolve(EA=TournamentEA, ea_parameters=ea_params)
@@ -435,10 +550,18 @@ class BioGPModel(BioGP):
         # Switch to bi-objective (error, complexity)
         self.minimize = [True, True]
         pop.update_fitness()
+        self._iteration_offset = self.params["single_obj_generations"]
+        self._final_phase = True
 
         print("Switching to bi-objective mode")
 
         pop.evolve(EA=self.params["training_algorithm"], ea_parameters=self.ea_params)
+        if self.subsampler is not None and self.subsampler.restore(self):
+            if self.subtree_cache is not None:
+                self.subtree_cache.clear()
+            pop.reevaluate()
+        # The cache is only valid for the training data
+        self.subtree_cache = None
 
         non_dom_front = pop.non_dominated()
         self.linear_node, self.fitness = self.select(
@@ -460,26 +583,7 @@ class BioGPModel(BioGP):
 
         """
 
-        sub_trees = []
-        # Stack outputs of subtrees to form weight matrix
-        for root in self.linear_node.roots:
-            sub_tree = root.predict(decision_variables)
-            if sub_tree.size == 1:
-                sub_tree = sub_tree.reshape(1)
-            sub_trees.append(sub_tree)
-
-        sub_trees = np.hstack(sub_trees)
-        axis = None
-        if sub_trees.ndim > 1:
-            axis = 1
-        sub_trees = np.insert(sub_trees, 0, 1, axis=axis)
-
-        y = np.dot(sub_trees, self.linear_node.linear)
-
-        if isinstance(y, float):
-            y = np.asarray([y])
-
-        return y
+        return self.linear_node.predict(decision_variables)
 
     def plot(self, prediction, target, name=None):
         """Creates and shows a plot for the model's prediction.
@@ -649,28 +753,37 @@ class Node:
         self.nodes_at_depth = None
         self.total_depth = None
         self.roots = []
+        self._program = None
 
     def predict(self, decision_variables=None):
+        """Evaluate the subtree under the node.
 
-        if callable(self.value):
-            values = [root.predict(decision_variables) for root in self.roots]
-            if self.depth == 0:
-                self.value = sum(values)
-                return self.value
-            else:
-                return self.value(*values)
+        Parameters
+        ----------
+        decision_variables : pd.DataFrame or np.ndarray
+            The data, one sample per row.
 
-        else:
-            if isinstance(decision_variables, np.ndarray) and isinstance(
-                self.value, str
-            ):
-                return decision_variables[
-                    :, int("".join(filter(str.isdigit, self.value))) - 1
-                ]
-            if isinstance(self.value, str):
-                return np.asarray(decision_variables[self.value]).reshape(-1, 1)
-            else:
-                return np.full((decision_variables.shape[0], 1), self.value)
+        Returns
+        -------
+        np.ndarray
+            Output of the subtree, shape (number of samples, 1).
+        """
+        return TreeProgram([self]).run(decision_variables)[:, 1:]
+
+    def program(self):
+        """Get the subtrees under the node compiled into a postfix program.
+
+        The program is cached until get_sub_nodes is called, which all operations
+        changing the tree do.
+
+        Returns
+        -------
+        TreeProgram
+            The compiled subtrees.
+        """
+        if self._program is None:
+            self._program = TreeProgram(self.roots)
+        return self._program
 
     def node_label(self):  # return string label
         if callable(self.value):
@@ -697,34 +810,125 @@ class Node:
     def get_sub_nodes(self):
         """Get all nodes belonging to the subtree under the current node.
 
+        Also sets the depths of the nodes, and nodes_at_depth and total_depth of
+        the current node.
+
         Returns
         -------
         nodes : list
-            A list of nodes in the subtree.
+            A list of nodes in the subtree, in breadth first order.
 
         """
-        nodes = []
+        # The tree may have changed
+        self._program = None
+        nodes = self._walk()
         nodes_at_depth = {}
-        stack = [self]
-        while stack:
-            cur_node = stack[0]
-            depth = cur_node.depth
-            if cur_node.depth not in nodes_at_depth:
-                nodes_at_depth[cur_node.depth] = []
-            nodes_at_depth[cur_node.depth].append(cur_node)
-            stack = stack[1:]
-            nodes.append(cur_node)
-            if len(cur_node.roots) > 0:
-                depth += 1
-            for child in cur_node.roots:
-                child.depth = depth
-                stack.append(child)
+        for node in nodes:
+            nodes_at_depth.setdefault(node.depth, []).append(node)
 
         self.nodes_at_depth = nodes_at_depth
-        self.total_depth = max(key for key in self.nodes_at_depth.keys())
+        # Breadth first, the last node is the deepest
+        self.total_depth = nodes[-1].depth
+
+        return nodes
 
+    def _walk(self):
+        """List the nodes of the subtree breadth first, setting their depths."""
+        nodes = [self]
+        # The list is extended while it is iterated over
+        for node in nodes:
+            depth = node.depth + 1
+            for child in node.roots:
+                child.depth = depth
+                nodes.append(child)
         return nodes
 
+    def replace_subtree(self, node, value, roots):
+        """Replace the value and the roots of a node in the subtree.
+
+        nodes, nodes_at_depth and total_depth are updated by walking only the
+        replaced and the new subtrees.
+
+        Parameters
+        ----------
+        node : Node
+            The node to change. It must be in nodes.
+        value : function, str or float
+            The new value of the node.
+        roots : list
+            The new roots of the node.
+        """
+        removed = [(sub_node, sub_node.depth) for sub_node in node._walk()[1:]]
+        node.value = value
+        node.roots = roots
+        self._update_nodes(removed, node._walk()[1:])
+
+    def swap_subtrees(self, node, other, other_node):
+        """Swap the subtrees under two nodes, the first one in this subtree and the
+        second one in the subtree of other.
+
+        The values and the roots of the two nodes are swapped. nodes,
+        nodes_at_depth and total_depth of both subtrees are updated by walking
+        only the swapped subtrees. other may be the current node, in which case
+        nothing is done if one of the nodes is under the other.
+
+        Parameters
+        ----------
+        node : Node
+            Node in nodes of the current node.
+        other : Node
+            The node whose subtree contains other_node.
+        other_node : Node
+            Node in nodes of other.
+        """
+        removed = [(sub_node, sub_node.depth) for sub_node in node._walk()[1:]]
+        other_removed = [
+            (sub_node, sub_node.depth) for sub_node in other_node._walk()[1:]
+        ]
+        if any(sub_node is other_node for sub_node, _ in removed) or any(
+            sub_node is node for sub_node, _ in other_removed
+        ):
+            # Swapping would create a cycle
+            return
+        node.value, other_node.value = other_node.value, node.value
+        node.roots, other_node.roots = other_node.roots, node.roots
+        added = node._walk()[1:]
+        other_added = other_node._walk()[1:]
+        if other is self:
+            self._update_nodes(removed + other_removed, added + other_added)
+        else:
+            self._update_nodes(removed, added)
+            other._update_nodes(other_removed, other_added)
+
+    def _update_nodes(self, removed, added):
+        """Remove and add nodes in nodes and nodes_at_depth.
+
+        Parameters
+        ----------
+        removed : list
+            Tuples of removed nodes and their depths before the removal.
+        added : list
+            Added nodes, with their depths set.
+        """
+        self._program = None
+        removed_ids = {id(node) for node, _ in removed}
+        if removed_ids:
+            self.nodes = [node for node in self.nodes if id(node) not in removed_ids]
+            for depth in {depth for _, depth in removed}:
+                remaining = [
+                    node
+                    for node in self.nodes_at_depth[depth]
+                    if id(node) not in removed_ids
+                ]
+                if remaining:
+                    self.nodes_at_depth[depth] = remaining
+                else:
+                    del self.nodes_at_depth[depth]
+        self.nodes.extend(added)
+        for node in added:
+            self.nodes_at_depth.setdefault(node.depth, []).append(node)
+        self.total_depth = max(self.nodes_at_depth)
+
     def grow_tree(self, max_depth=None, method="grow", depth=0, ind=None):
         """Create a random tree recursively using either grow or full method.
 
@@ -815,37 +1019,62 @@ class LinearNode(Node):
         self.fitness = None
         self.linear = None
 
-    def calculate_linear(self, X_train, y_train):
+    def predict(self, decision_variables=None):
+        """Predict using the weighted sum of the subtrees.
 
-        sub_trees = []
-        # Stack outputs of subtrees to form weight matrix
-        for root in self.roots:
-            sub_trees.append(root.predict(X_train))
+        Parameters
+        ----------
+        decision_variables : pd.DataFrame or np.ndarray
+            The data, one sample per row.
 
-        sub_trees = np.hstack(sub_trees)
-        axis = None
-        if sub_trees.ndim > 1:
-            axis = 1
-        sub_trees = np.insert(sub_trees, 0, 1, axis=axis)
+        Returns
+        -------
+        np.ndarray
+            The prediction.
+        """
+        return np.dot(self.program().run(decision_variables), self.linear)
 
-        weights, *_ = np.linalg.lstsq(sub_trees, y_train, rcond=None)
-        self.linear = weights
-        out = np.dot(sub_trees, weights)
+    def calculate_linear(self, X_train, y_train, cache=None):
+        """Fit the weights of the subtrees and calculate the objectives.
 
-        # Error reduction ratio
-        q, r = np.linalg.qr(sub_trees)
-        s = np.linalg.lstsq(q, y_train, rcond=None)[0]
-        error = np.divide((s ** 2 * np.sum(q * q, axis=0)), np.sum(out * out, axis=0))
+        Subtrees whose error reduction ratio is below error_lim are replaced by new
+        random subtrees.
+
+        Parameters
+        ----------
+        X_train : pd.DataFrame or np.ndarray
+            Training data input.
+        y_train : pd.DataFrame or np.ndarray
+            Training data target values.
+        cache : ArrayCache or None
+            Cache of subtree outputs calculated from X_train.
+
+        Returns
+        -------
+        list
+            The training error and the complexity of the tree.
+        """
+
+        # Outputs of the subtrees, after a column of ones for the bias
+        sub_trees = self.program().run(X_train, cache)
+        y_train = np.asarray(y_train)
+        weights, out, error = fit_linear(sub_trees, y_train)
+        self.linear = weights
 
         # If error reduction ration < err_lim, delete root and grow new one
-        for i, err in enumerate(error[1:]):
+        regrown = False
+        for i, err in enumerate(error):
             if err < self.params["error_lim"]:
                 del self.roots[i]
                 self.grow_tree(
                     max_depth=self.params["max_depth"], method="grow", ind=self
                 )
+                regrown = True
 
-        self.nodes = self.get_sub_nodes()
+        # The nodes are kept up to date by the recombination operators, so they
+        # are only listed for new and regrown trees
+        if regrown or self.total_depth is None:
+            self.nodes = self.get_sub_nodes()
 
         num_func_nodes = sum(1 for node in self.nodes if callable(node.value))
 
@@ -856,12 +1085,5 @@ class LinearNode(Node):
 
         self.out = out
         self.complexity = complexity
-        training_error = None
-
-        if self.params["loss_func"] == "root_mean_square":
-            training_error = np.sqrt(np.mean(((y_train - out) ** 2)))
-
-        elif self.params["loss_func"] == "root_median_square":
-            training_error = np.sqrt(np.median(((y_train - out) ** 2)))
 
-        return [training_error, self.complexity]
+        return [training_error(y_train, out, self.params["loss_func"]), complexity]
@@ -0,0 +1,322 @@
+import numpy as np
+import pandas as pd
+
+# Opcodes of the instructions
+_VARIABLE = 0
+_CONSTANT = 1
+_CALL = 2
+_LOOKUP = 3
+_STORE = 4
+
+
+class TreeProgram:
+    """A BioGP tree flattened into a postfix program.
+
+    The subtrees are compiled once into a list of instructions, which is run by a
+    stack machine over the columns of the data. Each instruction either pushes a
+    variable column or a constant on the stack, or calls a function on the values on
+    top of the stack. Functions whose arguments are all constants are evaluated
+    during the compilation. After running the program, the stack contains the
+    outputs of the subtrees.
+
+    The outputs of function nodes can be shared between programs through a cache.
+    They are keyed by the structure of the subtree under the node, so identical
+    subtrees, e.g. ones copied between individuals by crossover, are evaluated
+    only once. Each function node is preceded by an instruction looking up its
+    output, which skips the instructions of the subtree if the output is found,
+    and followed by an instruction storing its output.
+
+    Parameters
+    ----------
+    roots : list
+        The subtrees to compile, e.g. the roots of a LinearNode.
+
+    Attributes
+    ----------
+    code : list
+        The instructions as (opcode, argument) pairs. The opcode is the type of the
+        instruction: push a variable, push a constant, call a function, or look up
+        or store a subtree output. The argument is an index into variables,
+        constants or functions, or into subtree_keys for the cache instructions.
+    variables : list
+        Names of the variables used by the program.
+    constants : list
+        The constants used by the program.
+    functions : list
+        The functions called by the program, with their arities.
+    subtree_keys : list
+        Structural keys of the subtrees under the function nodes.
+    subtree_ends : list
+        Index of the instruction after each of these subtrees.
+    """
+
+    def __init__(self, roots):
+        self._build(_node_prefix(roots), len(roots))
+
+    @classmethod
+    def from_prefix(cls, prefix, num_outputs):
+        """Compile trees given in prefix order.
+
+        Parameters
+        ----------
+        prefix : iterable
+            (value, arity) of the nodes of the trees in prefix order. The value of a
+            function node is the function, of a terminal node the variable name or
+            the constant.
+        num_outputs : int
+            Number of trees.
+
+        Returns
+        -------
+        TreeProgram
+            The compiled trees.
+        """
+        program = cls.__new__(cls)
+        program._build(prefix, num_outputs)
+        return program
+
+    def _build(self, prefix, num_outputs):
+        self.variables = []
+        self.constants = []
+        self.functions = []
+        self.subtree_keys = []
+        self.subtree_ends = []
+        self._variable_ids = {}
+        self._function_ids = {}
+        self._column_indices = None
+        self.num_outputs = num_outputs
+        self.code = self._compile(prefix)
+
+    def __deepcopy__(self, memo):
+        # The program does not change after compilation, so copies of a tree can
+        # share it
+        return self
+
+    def _compile(self, prefix):
+        """Translate trees in prefix order to postfix instructions."""
+        code = []
+        # Function nodes whose arguments are being compiled, with the index of
+        # their first instruction and the length of keys before their arguments
+        pending = []
+        # Structural keys of the values on the stack of the program
+        keys = []
+        for value, arity in prefix:
+            if callable(value):
+                pending.append((value, arity, len(code), len(keys)))
+                code.append((_LOOKUP, len(self.subtree_keys)))
+                self.subtree_keys.append(None)
+                self.subtree_ends.append(None)
+            else:
+                opcode, argument = self._terminal(value)
+                code.append((opcode, argument))
+                if opcode == _VARIABLE:
+                    keys.append(self.variables[argument])
+                else:
+                    keys.append(self.constants[argument])
+            # Finish the function nodes whose arguments are all compiled
+            while pending and len(keys) == pending[-1][3] + pending[-1][1]:
+                function, arity, start, num_keys = pending.pop()
+                args = keys[num_keys:]
+                del keys[num_keys:]
+                arg_code = code[start + 1 :]
+                if all(opcode == _CONSTANT for opcode, _ in arg_code):
+                    # Fold constant expressions, dropping the cache instructions
+                    values = [self.constants[argument] for _, argument in arg_code]
+                    del code[start:]
+                    code.append(self._constant(float(function(*values))))
+                    keys.append(self.constants[-1])
+                    continue
+                if (function, arity) not in self._function_ids:
+                    self._function_ids[function, arity] = len(self.functions)
+                    self.functions.append((function, arity))
+                slot = code[start][1]
+                code.append((_CALL, self._function_ids[function, arity]))
+                code.append((_STORE, slot))
+                self.subtree_keys[slot] = _SubtreeKey((function, *args))
+                self.subtree_ends[slot] = len(code)
+                keys.append(self.subtree_keys[slot])
+        return code
+
+    def _terminal(self, value):
+        if not isinstance(value, str):
+            return self._constant(float(value))
+        if value not in self._variable_ids:
+            self._variable_ids[value] = len(self.variables)
+            self.variables.append(value)
+        return _VARIABLE, self._variable_ids[value]
+
+    def _constant(self, value):
+        self.constants.append(value)
+        return _CONSTANT, len(self.constants) - 1
+
+    def columns(self, data):
+        """Get the columns of the variables used by the program.
+
+        Parameters
+        ----------
+        data : pd.DataFrame or np.ndarray
+            The data, one sample per row. Variables are looked up by column name in
+            a DataFrame. In an array, variable "x1" is the first column, "x2" the
+            second and so on.
+
+        Returns
+        -------
+        list of np.ndarray
+            The column of each variable.
+        """
+        if isinstance(data, pd.DataFrame):
+            return [data[name].to_numpy(dtype=float) for name in self.variables]
+        if self._column_indices is None:
+            self._column_indices = [
+                int("".join(filter(str.isdigit, name))) - 1 for name in self.variables
+            ]
+        data = np.asarray(data, dtype=float)
+        return [data[:, index] for index in self._column_indices]
+
+    def run(self, data, cache=None):
+        """Run the program.
+
+        Parameters
+        ----------
+        data : pd.DataFrame or np.ndarray
+            The data, one sample per row.
+        cache : ArrayCache or None
+            Cache of subtree outputs, see pyrvea.OtherTools.array_cache. The cached
+            outputs must have been calculated from the same data.
+
+        Returns
+        -------
+        np.ndarray
+            A column of ones followed by the outputs of the subtrees, shape (number
+            of samples, number of subtrees + 1).
+        """
+        columns = self.columns(data)
+        constants = self.constants
+        functions = self.functions
+        code = self.code
+        stack = []
+        i = 0
+        while i < len(code):
+            opcode, argument = code[i]
+            i += 1
+            if opcode == _VARIABLE:
+                stack.append(columns[argument])
+            elif opcode == _CONSTANT:
+                stack.append(constants[argument])
+            elif opcode == _CALL:
+                function, arity = functions[argument]
+                if arity == 1:
+                    stack[-1] = function(stack[-1])
+                elif arity == 2:
+                    second = stack.pop()
+                    stack[-1] = function(stack[-1], second)
+                else:
+                    args = stack[len(stack) - arity :]
+                    del stack[len(stack) - arity :]
+                    stack.append(function(*args))
+            elif cache is None:
+                continue
+            elif opcode == _LOOKUP:
+                output = cache.get(self.subtree_keys[argument])
+                if output is not None:
+                    stack.append(output)
+                    i = self.subtree_ends[argument]
+            elif isinstance(stack[-1], np.ndarray):
+                cache.put(self.subtree_keys[argument], stack[-1])
+        out = np.empty((data.shape[0], self.num_outputs + 1))
+        out[:, 0] = 1
+        for i, output in enumerate(stack, start=1):
+            out[:, i] = output
+        return out
+
+
+def fit_linear(sub_trees, y_train):
+    """Fit the weights of the linear node by linear least squares.
+
+    Parameters
+    ----------
+    sub_trees : np.ndarray
+        A column of ones followed by the outputs of the subtrees, as returned by
+        TreeProgram.run.
+    y_train : np.ndarray
+        Training data target values.
+
+    Returns
+    -------
+    weights : np.ndarray
+        The bias followed by the weights of the subtrees.
+    out : np.ndarray
+        Output of the linear node.
+    error_reduction : np.ndarray
+        Error reduction ratio of each subtree.
+    """
+    weights, *_ = np.linalg.lstsq(sub_trees, y_train, rcond=None)
+    out = np.dot(sub_trees, weights)
+
+    # Error reduction ratio
+    q, r = np.linalg.qr(sub_trees)
+    s = np.linalg.lstsq(q, y_train, rcond=None)[0]
+    error = np.divide((s ** 2 * np.sum(q * q, axis=0)), np.sum(out * out, axis=0))
+    return weights, out, error[1:]
+
+
+def training_error(y_train, out, loss_func):
+    """Training error of the output of a linear node.
+
+    Parameters
+    ----------
+    y_train : np.ndarray
+        Training data target values.
+    out : np.ndarray
+        Output of the linear node.
+    loss_func : str
+        "root_mean_square" or "root_median_square".
+
+    Returns
+    -------
+    float or None
+        The error, None for an unknown loss function.
+    """
+    if loss_func == "root_mean_square":
+        return np.sqrt(np.mean(((y_train - out) ** 2)))
+    elif loss_func == "root_median_square":
+        return np.sqrt(np.median(((y_train - out) ** 2)))
+    return None
+
+
+def _node_prefix(roots):
+    """Generate (value, arity) of the nodes under roots in prefix order."""
+    stack = list(reversed(roots))
+    while stack:
+        node = stack.pop()
+        if callable(node.value):
+            yield node.value, len(node.roots)
+            stack.extend(reversed(node.roots))
+        else:
+            # Terminals may have leftover roots, e.g. after mutation
+            yield node.value, 0
+
+
+class _SubtreeKey:
+    """Structural key of a subtree.
+
+    The structure is a tuple of the function of the node and the keys of its
+    children, which are variable names, constants or keys of subtrees. The hash is
+    calculated once, so hashing does not walk the subtree.
+    """
+
+    __slots__ = ("structure", "hash")
+
+    def __init__(self, structure):
+        self.structure = structure
+        self.hash = hash(structure)
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        return self is other or (
+            isinstance(other, _SubtreeKey)
+            and self.hash == other.hash
+            and self.structure == other.structure
+        )
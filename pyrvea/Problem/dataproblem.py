@@ -1,3 +1,6 @@
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os import cpu_count
 from typing import List
 
 import numpy as np
@@ -98,7 +101,30 @@ class DataProblem(BaseProblem):
             self.train_indices.append(train_indices)
             self.test_indices.append(test_indices)
 
-    def train(self, model_type: str = None, objectives: str = None, **kwargs):
+    def train(
+        self,
+        model_type: str = None,
+        objectives: str = None,
+        num_workers: int = 1,
+        **kwargs
+    ):
+        """Train a surrogate model for each objective and training run.
+
+        Parameters
+        ----------
+        model_type : str
+            "GPR", "MLP" (default), "EvoNN", "EvoDN2" or "BioGP".
+        objectives : list
+            The objectives to model. If None, all objectives.
+        num_workers : int
+            Number of processes training the models concurrently. The models of all
+            objectives and training runs are independent, so they are trained in
+            parallel if this is more than 1. If None, the number of CPUs is used.
+            In parallel, the progress of each model is printed when it is completed.
+        kwargs
+            Parameters passed to the models.
+
+        """
         if objectives is None:
             objectives = self.y
         if model_type is None:
@@ -113,27 +139,75 @@ class DataProblem(BaseProblem):
         model_type = surrogate_model_options[model_type]
         # Build specific surrogate models
         print("Building Surrogate Models ...")
-        # Fit to data using Maximum Likelihood Estimation of the parameters
-        for obj in objectives:
-
-            print("Building model for " + str(obj))
-            for train_run, train_indices in enumerate(self.train_indices):
-                print("Training run number", train_run, "of", len(self.train_indices))
-                model = model_type(**kwargs)
-                model.fit(
-                    self.data[self.x].loc[train_indices],
-                    self.data[obj].loc[train_indices],
-                )
-                self.models[obj].append(model)
+        if num_workers is None:
+            num_workers = cpu_count() or 1
+        if num_workers > 1:
+            self._train_parallel(model_type, objectives, num_workers, kwargs)
+        else:
+            # Fit to data using Maximum Likelihood Estimation of the parameters
+            for obj in objectives:
+
+                print("Building model for " + str(obj))
+                for train_run, train_indices in enumerate(self.train_indices):
+                    print(
+                        "Training run number", train_run, "of", len(self.train_indices)
+                    )
+                    model = model_type(**kwargs)
+                    model.fit(
+                        self.data[self.x].loc[train_indices],
+                        self.data[obj].loc[train_indices],
+                    )
+                    self.models[obj].append(model)
 
         # Select model
         print("Surrogate models build completed.")
 
+    def _train_parallel(self, model_type, objectives, num_workers, kwargs):
+        """Train the models of all objectives and training runs in a process pool.
+
+        Each model is trained with its own random seed drawn from the random state
+        of the calling process, so that the workers do not repeat each other's
+        random numbers. A line is printed as each model is completed, in the order
+        of completion.
+        """
+        jobs = [
+            (obj, train_run, train_indices)
+            for obj in objectives
+            for train_run, train_indices in enumerate(self.train_indices)
+        ]
+        seeds = np.random.randint(2 ** 31, size=len(jobs))
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = [
+                executor.submit(
+                    _fit_model,
+                    model_type,
+                    kwargs,
+                    self.data[self.x].loc[train_indices],
+                    self.data[obj].loc[train_indices],
+                    seed,
+                )
+                for (obj, _, train_indices), seed in zip(jobs, seeds.tolist())
+            ]
+            job_of_future = dict(zip(futures, jobs))
+            for future in as_completed(futures):
+                obj, train_run, _ = job_of_future[future]
+                print(
+                    "Finished model for " + str(obj) + ", training run",
+                    train_run,
+                    "of",
+                    len(self.train_indices),
+                )
+                # Raise errors of the workers as soon as they occur
+                future.result()
+            # Models are added in the order of the training runs
+            for (obj, _, _), future in zip(jobs, futures):
+                self.models[obj].append(future.result())
+
     def transform_new_data(self, decision_variables):
         decision_variables_transformed = decision_variables
         if len(self.preprocessing_transformations) > 0:
             for transformation in self.preprocessing_transformations:
-                decision_variables_transformed = transformation.transfrom(
+                decision_variables_transformed = transformation.transform(
                     decision_variables_transformed
                 )
         return decision_variables_transformed
@@ -152,18 +226,62 @@ class DataProblem(BaseProblem):
                 y_pred = np.hstack((y_pred, y))
         return y_pred
 
-    def testing_score(self):  # Return R-squared of testing
-        x, y = self.select_data(self.test_indices)
-        x = self.transform_new_data(x)
-        y_pred = None
-        for i in range(np.shape(x)[0]):
-            if y_pred is None:
-                y_pred = np.asarray(self.surrogates_predict(x[i]))
-            else:
-                y_pred = np.vstack((y_pred, self.surrogates_predict(x[i])))
-        for i in range(np.shape(y)[1]):
-            self.r_sq.append(r2_score(y[:, i], y_pred[:, i]))
-        return y_pred
+    def select_data(self, indices):
+        """Get the decision variables and the objective values of samples.
+
+        Parameters
+        ----------
+        indices : list
+            Indices of the samples in data.
+
+        Returns
+        -------
+        x : pd.DataFrame
+            The decision variables, one sample per row.
+        y : pd.DataFrame
+            The objective values, one sample per row.
+
+        """
+        samples = self.data.loc[indices]
+        return samples[self.x], samples[self.y]
+
+    def testing_score(self):
+        """Score the surrogate models on the test data.
+
+        The model of an objective from each training run is scored on the test
+        indices of the same run, so k-fold validation gives one score per fold. Each
+        model predicts all of its test samples with one call.
+
+        Returns
+        -------
+        metrics : pd.DataFrame
+            One row per training run and objective, with the coefficient of
+            determination (r_squared) and the root mean square error (rmse) of the
+            predictions. Also stored in metrics.
+
+        """
+        rows = []
+        for run, test_indices in enumerate(self.test_indices):
+            x, y = self.select_data(test_indices)
+            x = self.transform_new_data(x)
+            for obj in self.y:
+                if run >= len(self.models[obj]):
+                    # No model trained for this objective
+                    continue
+                y_pred = np.reshape(self.models[obj][run].predict(x), (len(y), -1))
+                error = y[obj].to_numpy() - y_pred[:, 0]
+                rows.append(
+                    {
+                        "run": run,
+                        "objective": obj,
+                        "r_squared": r2_score(y[obj], y_pred[:, 0]),
+                        "rmse": np.sqrt(np.mean(error ** 2)),
+                    }
+                )
+        self.metrics = pd.DataFrame(
+            rows, columns=["run", "objective", "r_squared", "rmse"]
+        )
+        return self.metrics
 
     def retrain_surrogate(self):
         pass
@@ -189,3 +307,60 @@ class DataProblem(BaseProblem):
             )
 
         return objectives
+
+    def evaluate_batch(self, decision_variables):
+        """Objectives function for many samples at once.
+
+        The surrogate model of each objective predicts all samples with one call,
+        instead of one call per sample as in objectives.
+
+        Parameters
+        ----------
+        decision_variables : array_like
+            The decision variables, one sample per row.
+
+        Returns
+        -------
+        objectives : ndarray
+            The objective values, shape (number of samples, number of objectives).
+
+        """
+        num_samples = len(decision_variables)
+        objectives = np.empty((num_samples, self.num_of_objectives))
+        if num_samples == 0:
+            return objectives
+        decision_variables = np.reshape(
+            np.asarray(decision_variables, dtype=float), (num_samples, -1)
+        )
+        for i, obj in enumerate(self.y):
+            prediction = self.models[obj][0].predict(decision_variables)
+            objectives[:, i] = np.reshape(prediction, (num_samples, -1))[:, 0]
+
+        return objectives
+
+
+def _fit_model(model_type, kwargs, x, y, seed):
+    """Create and fit a surrogate model in a worker process of DataProblem.train.
+
+    Parameters
+    ----------
+    model_type : type
+        Class of the model.
+    kwargs : dict
+        Parameters passed to the model.
+    x : pd.DataFrame
+        Training data input.
+    y : pd.Series
+        Training data target values.
+    seed : int
+        Seed of the random number generators of the worker.
+
+    Returns
+    -------
+    The fitted model.
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    model = model_type(**kwargs)
+    model.fit(x, y)
+    return model
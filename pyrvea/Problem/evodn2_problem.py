@@ -1,4 +1,5 @@
 import random
+from copy import deepcopy
 
 import numpy as np
 import plotly
@@ -6,8 +7,14 @@ import plotly.graph_objs as go
 from scipy.special import expit
 
 from pyrvea.EAs.PPGA import PPGA
+from pyrvea.OtherTools.array_cache import ArrayCache
+from pyrvea.OtherTools.linear_solvers import cholesky_lstsq, lstsq
 from pyrvea.Population.Population import Population
 from pyrvea.Problem.baseproblem import BaseProblem
+from pyrvea.Problem.subsampling import Subsampler
+
+# Maximum number of elements in the subnet layers evaluated at once
+_MAX_BATCH_ELEMENTS = 2 ** 20
 
 
 class EvoDN2(BaseProblem):
@@ -71,6 +78,30 @@ class EvoDN2(BaseProblem):
         self.num_samples = num_samples
         self.subsets = subsets
         self.params = params
+        self.subsampler = None
+        self.subnet_cache = None
+
+    def start_iteration(self, iteration, iterations):
+        """Switch to the training data of the iteration if subsampling is used.
+
+        Parameters
+        ----------
+        iteration : int
+            Index of the iteration about to start.
+        iterations : int or None
+            Total number of iterations, or None before the evolution starts.
+
+        Returns
+        -------
+        bool
+            True if the training data changed.
+        """
+        if self.subsampler is None:
+            return False
+        changed = self.subsampler.start_iteration(self, iteration, iterations)
+        if changed and self.subnet_cache is not None:
+            self.subnet_cache.clear()
+        return changed
 
     def objectives(self, decision_variables) -> list:
         """ Use this method to calculate objective functions.
@@ -94,6 +125,9 @@ class EvoDN2(BaseProblem):
 
     def activation(self, decision_variables):
         """ Calculates the dot product and applies the activation function.
+
+        The outputs of subnets found in subnet_cache are not calculated again.
+
         Parameters
         ----------
         decision_variables : ndarray
@@ -107,29 +141,238 @@ class EvoDN2(BaseProblem):
             The complexity of the neural network
         """
         network_complexity = []
-        non_linear_layer = np.empty((self.num_samples, 0))
+        non_linear_layer = _output_buffer(len(self.X_train), decision_variables)
+        end = 0
 
         for i, subnet in enumerate(decision_variables):
 
+            cached = None
+            if self.subnet_cache is not None:
+                key = _subnet_key(i, subnet)
+                cached = self.subnet_cache.get(key)
+
             # Get the input variables for the first layer
             in_nodes = self.X_train[:, self.subsets[i]]
             subnet_complexity = 1
 
             for layer in subnet:
-                # Calculate the dot product + bias
-                out = np.dot(in_nodes, layer[1:, :]) + layer[0]
-
                 subnet_complexity = np.dot(subnet_complexity, np.abs(layer[1:, :]))
 
-                in_nodes = self.activate(self.params["activation_func"], out)
+                if cached is None:
+                    # Calculate the dot product + bias
+                    out = np.dot(in_nodes, layer[1:, :]) + layer[0]
+
+                    in_nodes = self.activate(self.params["activation_func"], out)
+
+            if cached is not None:
+                in_nodes = cached.T
+            elif self.subnet_cache is not None:
+                self.subnet_cache.put(key, np.ascontiguousarray(in_nodes.T))
 
             network_complexity.append(np.sum(subnet_complexity))
-            non_linear_layer = np.hstack((non_linear_layer, in_nodes))
+            non_linear_layer[:, end : end + in_nodes.shape[1]] = in_nodes
+            end += in_nodes.shape[1]
 
         complexity = np.sum(network_complexity)
 
         return non_linear_layer, complexity
 
+    def evaluate_batch(self, decision_variables):
+        """Calculate the objective functions of many networks at once.
+
+        The subnets of all networks are calculated together with batched matrix
+        products, see batch_activation, and the final layers of networks with the
+        same number of output nodes are solved together. The networks are processed
+        in chunks to limit memory use. Falls back to evaluating the networks one by
+        one if opt_func is not "llsq" or "llsq_cholesky".
+
+        Parameters
+        ----------
+        decision_variables : list
+            The networks, each a list of subnets.
+
+        Returns
+        -------
+        np.ndarray
+            Training error and complexity of each network, one row per network.
+        """
+        if (
+            self.params["opt_func"] not in ("llsq", "llsq_cholesky")
+            or len(decision_variables) == 0
+        ):
+            return super().evaluate_batch(decision_variables)
+
+        networks = list(decision_variables)
+        x_train = np.asarray(self.X_train)
+        y_train = np.asarray(self.y_train, dtype=float).reshape(len(x_train), -1)
+        obj_func = np.empty((len(networks), 2))
+
+        max_nodes = _max_nodes(networks)
+        chunk = max(
+            1, _MAX_BATCH_ELEMENTS // (len(x_train) * len(self.subsets) * max_nodes)
+        )
+        for start in range(0, len(networks), chunk):
+            layers, outputs, complexity = self.batch_activation(
+                networks[start : start + chunk]
+            )
+            obj_func[start : start + len(layers), 1] = complexity
+
+            # Gather the outputs of networks with the same number of them
+            num_outputs = np.count_nonzero(outputs, axis=1)
+            for size in np.unique(num_outputs):
+                group = np.flatnonzero(num_outputs == size)
+                rows = np.nonzero(outputs[group])[1].reshape(len(group), size)
+                activated_layer = np.swapaxes(layers[group[:, np.newaxis], rows], 1, 2)
+                if self.params["opt_func"] == "llsq":
+                    linear_layer = lstsq(activated_layer, y_train)
+                else:
+                    linear_layer = cholesky_lstsq(activated_layer, y_train)
+                obj_func[start + group, 0] = self._training_errors(
+                    activated_layer @ linear_layer, y_train
+                )
+
+        return obj_func
+
+    def _training_errors(self, predicted_values, y_train):
+        """Training errors of a stack of predictions.
+
+        Parameters
+        ----------
+        predicted_values : np.ndarray
+            Predictions, shape (number of networks, number of samples, number of
+            targets).
+        y_train : np.ndarray
+            Target values, shape (number of samples, number of targets).
+
+        Returns
+        -------
+        np.ndarray
+            The training error of each network.
+        """
+        squared_error = (y_train - predicted_values) ** 2
+        squared_error = squared_error.reshape(len(squared_error), -1)
+
+        if self.params["loss_func"] == "root_mean_square":
+            return np.sqrt(np.mean(squared_error, axis=1))
+
+        elif self.params["loss_func"] == "root_median_square":
+            return np.sqrt(np.median(squared_error, axis=1))
+
+        return np.full(len(squared_error), np.nan)
+
+    def batch_activation(self, networks):
+        """Calculate the final non-linear layers of many networks on X_train together.
+
+        The outputs of the layers of each subnet are kept in a tensor over all
+        networks, padded to the largest number of nodes. Layers of the same shape
+        are stacked, so that they are calculated for all networks with one batched
+        matrix product, reading and writing only the real nodes of the tensor.
+        Networks whose subnet has fewer layers keep the output of their last layer.
+        The layers are calculated transposed, one row per node, so that the nodes
+        of a network are contiguous.
+
+        The outputs of subnets found in subnet_cache, or identical to a subnet of
+        another network in the batch, are not calculated again.
+
+        Parameters
+        ----------
+        networks : list
+            The networks, each a list of subnets.
+
+        Returns
+        -------
+        non_linear_layers : np.ndarray
+            Transposed outputs of the subnets one after another, shape (number of
+            networks, number of subnets * largest number of nodes, number of
+            samples). Each subnet takes the same number of rows, of which only the
+            first ones are its outputs. The other rows are undefined.
+        outputs : np.ndarray
+            Mask of the rows which are outputs of the subnets, shape (number of
+            networks, number of subnets * largest number of nodes).
+        complexity : np.ndarray
+            The complexity of each network.
+        """
+        data = np.asarray(self.X_train)
+        num_networks = len(networks)
+        max_nodes = _max_nodes(networks)
+        activation_func = self.params["activation_func"]
+
+        non_linear_layers = np.empty(
+            (num_networks, len(self.subsets) * max_nodes, len(data))
+        )
+        outputs = np.zeros((num_networks, len(self.subsets), max_nodes), dtype=bool)
+        complexity = np.zeros(num_networks)
+
+        for i, subset in enumerate(self.subsets):
+            subnets = [network[i] for network in networks]
+            num_layers = [len(subnet) for subnet in subnets]
+            in_data = np.ascontiguousarray(data[:, subset].T)
+            # Output of the last layer calculated, written in place in the result
+            in_nodes = non_linear_layers[:, i * max_nodes : (i + 1) * max_nodes]
+            subnet_complexity = np.empty((num_networks, max_nodes, len(subset)))
+
+            # Networks whose subnet is calculated, and the networks which copy the
+            # output of an identical subnet
+            calculate = np.ones(num_networks, dtype=bool)
+            copies = []
+            if self.subnet_cache is not None:
+                keys = [_subnet_key(i, subnet) for subnet in subnets]
+                first = {}
+                for network, key in enumerate(keys):
+                    cached = self.subnet_cache.get(key)
+                    if cached is not None:
+                        in_nodes[network, : len(cached)] = cached
+                        calculate[network] = False
+                    elif key in first:
+                        copies.append((network, first[key]))
+                        calculate[network] = False
+                    else:
+                        first[key] = network
+
+            for depth in range(max(num_layers)):
+                groups = {}
+                for network, subnet in enumerate(subnets):
+                    if len(subnet) > depth:
+                        groups.setdefault(subnet[depth].shape, []).append(network)
+                for (num_in, num_out), group in groups.items():
+                    weights = np.stack([subnets[k][depth].T for k in group])
+                    group = np.array(group)
+                    num_in -= 1
+                    magnitude = np.abs(weights[:, :, 1:])
+                    if depth == 0:
+                        subnet_complexity[group, :num_out] = magnitude
+                    else:
+                        subnet_complexity[group, :num_out] = np.matmul(
+                            magnitude, subnet_complexity[group, :num_in]
+                        )
+
+                    weights = weights[calculate[group]]
+                    group = group[calculate[group]]
+                    if len(group) == 0:
+                        continue
+                    # Calculate the dot product + bias
+                    if depth == 0:
+                        out = np.matmul(weights[:, :, 1:], in_data)
+                    else:
+                        out = np.matmul(weights[:, :, 1:], in_nodes[group, :num_in])
+                    out += weights[:, :, :1]
+                    in_nodes[group, :num_out] = self.activate(activation_func, out)
+
+            for network, source in copies:
+                in_nodes[network] = in_nodes[source]
+            if self.subnet_cache is not None:
+                for network in np.flatnonzero(calculate).tolist():
+                    output = in_nodes[network, : subnets[network][-1].shape[1]]
+                    self.subnet_cache.put(keys[network], output.copy())
+
+            for network, subnet in enumerate(subnets):
+                outputs[network, i, : subnet[-1].shape[1]] = True
+            complexity += np.sum(
+                subnet_complexity, axis=2, where=outputs[:, i, :, np.newaxis]
+            ).sum(axis=1)
+
+        return non_linear_layers, outputs.reshape(num_networks, -1), complexity
+
     def calculate_linear(self, activated_layer):
         """ Apply the linear function to the final output layer
         and calculate the training error.
@@ -158,6 +401,13 @@ class EvoDN2(BaseProblem):
             linear_layer = linear_solution[0]
             predicted_values = np.dot(activated_layer, linear_layer)
 
+        elif self.params["opt_func"] == "llsq_cholesky":
+            linear_layer = cholesky_lstsq(
+                activated_layer, np.reshape(self.y_train, (len(activated_layer), -1))
+            )
+            linear_layer = linear_layer.reshape((-1,) + np.shape(self.y_train)[1:])
+            predicted_values = np.dot(activated_layer, linear_layer)
+
         if self.params["loss_func"] == "root_mean_square":
             training_error = np.sqrt(np.mean(((self.y_train - predicted_values) ** 2)))
 
@@ -195,8 +445,8 @@ class EvoDN2(BaseProblem):
             # Return the model with the lowest error
 
             lowest_error = np.argmin(pop.objectives[:, 0])
-            model = pop.individuals[lowest_error]
-            fitness = pop.fitness[lowest_error]
+            model = deepcopy(pop.individuals[lowest_error])
+            fitness = np.copy(pop.fitness[lowest_error])
 
         elif selection == "manual":
 
@@ -240,8 +490,8 @@ class EvoDN2(BaseProblem):
                 if model_idx not in non_dom_front:
                     print("Model " + str(model_idx) + " not found.")
 
-            model = pop.individuals[int(model_idx)]
-            fitness = pop.fitness[int(model_idx)]
+            model = deepcopy(pop.individuals[int(model_idx)])
+            fitness = np.copy(pop.fitness[int(model_idx)])
 
         return model, fitness
 
@@ -318,6 +568,9 @@ class EvoDN2Model(EvoDN2):
         activation_func="sigmoid",
         opt_func="llsq",
         loss_func="root_mean_square",
+        subsample_size=None,
+        full_data_iterations=1,
+        subnet_cache_bytes=2 ** 28,
         selection="min_error",
         recombination_type="evodn2_xover_mutation",
         crossover_type="standard",
@@ -351,8 +604,24 @@ class EvoDN2Model(EvoDN2):
             Function to use for activation.
         opt_func : str
             Function to use for optimizing the final layer of the model.
+            "llsq" solves the linear least squares problem, and "llsq_cholesky"
+            solves its normal equations, which is faster but less accurate for
+            ill-conditioned problems.
         loss_func : str
             The loss function to use.
+        subsample_size : int or float or None
+            If given, the training error is calculated on rotating subsamples of
+            this many samples (or this fraction of the samples) during the
+            evolution, see pyrvea.Problem.subsampling.Subsampler. None uses the
+            full data throughout.
+        full_data_iterations : int
+            Number of final iterations which use the full data when subsample_size
+            is given. The model is always selected on the full data.
+        subnet_cache_bytes : int
+            Maximum size in bytes of the cache of subnet outputs shared by the
+            population during training. Subnets found in the cache, e.g. ones left
+            unchanged by crossover and mutation, are not evaluated again. 0
+            disables the cache.
         selection : str
             The selection to use for selecting the model.
         recombination_type, crossover_type, mutation_type : str
@@ -378,6 +647,9 @@ class EvoDN2Model(EvoDN2):
             "activation_func": activation_func,
             "opt_func": opt_func,
             "loss_func": loss_func,
+            "subsample_size": subsample_size,
+            "full_data_iterations": full_data_iterations,
+            "subnet_cache_bytes": subnet_cache_bytes,
             "selection": selection,
             "crossover_type": crossover_type,
             "mutation_type": mutation_type,
@@ -438,6 +710,19 @@ class EvoDN2Model(EvoDN2):
         """
         Create a random population, evolve it and select a model based on selection.
         """
+        self.subsampler = None
+        if self.params["subsample_size"]:
+            self.subsampler = Subsampler(
+                self.X_train,
+                self.y_train,
+                self.params["subsample_size"],
+                self.params["full_data_iterations"],
+            )
+        self.subnet_cache = None
+        if self.params.get("subnet_cache_bytes"):
+            self.subnet_cache = ArrayCache(self.params["subnet_cache_bytes"])
+        # The initial population is evaluated on the first subsample
+        self.start_iteration(0, None)
         pop = Population(
             self,
             assign_type="EvoDN2",
@@ -449,6 +734,12 @@ class EvoDN2Model(EvoDN2):
         )
 
         pop.evolve(EA=self.params["training_algorithm"], ea_parameters=self.ea_params)
+        if self.subsampler is not None and self.subsampler.restore(self):
+            if self.subnet_cache is not None:
+                self.subnet_cache.clear()
+            pop.reevaluate()
+        # The cache is only valid for the training data
+        self.subnet_cache = None
 
         non_dom_front = pop.non_dominated()
         self.subnets, self.fitness = self.select(
@@ -471,7 +762,8 @@ class EvoDN2Model(EvoDN2):
             The prediction of the model.
 
         """
-        non_linear_layer = np.empty((decision_variables.shape[0], 0))
+        non_linear_layer = _output_buffer(decision_variables.shape[0], self.subnets)
+        end = 0
 
         for i, subnet in enumerate(self.subnets):
 
@@ -483,7 +775,8 @@ class EvoDN2Model(EvoDN2):
 
                 in_nodes = self.activate(self.params["activation_func"], out)
 
-            non_linear_layer = np.hstack((non_linear_layer, in_nodes))
+            non_linear_layer[:, end : end + in_nodes.shape[1]] = in_nodes
+            end += in_nodes.shape[1]
 
         y = np.dot(non_linear_layer, self.linear_layer)
 
@@ -622,3 +915,22 @@ class EvoDN2Model(EvoDN2):
 
             svr = np.vstack((svr, ["x" + str(i + 1), s]))
             self.svr = svr
+
+
+def _max_nodes(networks):
+    """Largest number of nodes in a layer of the networks."""
+    return max(
+        layer.shape[1] for network in networks for subnet in network for layer in subnet
+    )
+
+
+def _subnet_key(index, subnet):
+    """Key of the output of a subnet in the cache: the index of the subnet and the
+    shapes and weights of its layers."""
+    return index, tuple((layer.shape, layer.tobytes()) for layer in subnet)
+
+
+def _output_buffer(num_samples, subnets):
+    """Allocate the final non-linear layer of a network, one column per output node
+    of its subnets."""
+    return np.empty((num_samples, sum(subnet[-1].shape[1] for subnet in subnets)))
@@ -5,8 +5,18 @@ from scipy.optimize import lsq_linear
 from scipy.special import expit
 
 from pyrvea.EAs.PPGA import PPGA
+from pyrvea.OtherTools.linear_solvers import (
+    GramCache,
+    cholesky_lstsq,
+    lstsq,
+    solve_normal_equations,
+)
 from pyrvea.Population.Population import Population
 from pyrvea.Problem.baseproblem import BaseProblem
+from pyrvea.Problem.subsampling import Subsampler
+
+# Maximum number of elements in the hidden layers evaluated at once
+_MAX_BATCH_ELEMENTS = 2 ** 20
 
 
 class EvoNN(BaseProblem):
@@ -70,6 +80,30 @@ class EvoNN(BaseProblem):
         self.num_of_objectives = num_of_objectives
         self.params = params
         self.num_samples = num_samples
+        self._gram_cache = None
+        self.subsampler = None
+
+    def start_iteration(self, iteration, iterations):
+        """Switch to the training data of the iteration if subsampling is used.
+
+        Parameters
+        ----------
+        iteration : int
+            Index of the iteration about to start.
+        iterations : int or None
+            Total number of iterations, or None before the evolution starts.
+
+        Returns
+        -------
+        bool
+            True if the training data changed.
+        """
+        if self.subsampler is None:
+            return False
+        changed = self.subsampler.start_iteration(self, iteration, iterations)
+        if changed:
+            self._gram_cache = None
+        return changed
 
     def objectives(self, decision_variables) -> list:
         """ Use this method to calculate objective functions.
@@ -93,6 +127,162 @@ class EvoNN(BaseProblem):
 
         return obj_func
 
+    def evaluate_batch(self, decision_variables):
+        """Calculate the objective functions of many networks at once.
+
+        The weight matrices are stacked, so that the hidden layers of all networks
+        are calculated with one batched matrix product and the linear layers are
+        solved together. The networks are processed in chunks to limit memory use.
+        Falls back to evaluating the networks one by one if opt_func is
+        "llsq_constrained" or the networks are of different sizes.
+
+        Parameters
+        ----------
+        decision_variables : array_like
+            Weight matrices of the networks.
+
+        Returns
+        -------
+        np.ndarray
+            Training error and complexity of each network, one row per network.
+        """
+        if (
+            self.params["opt_func"] not in ("llsq", "llsq_cholesky")
+            or len(decision_variables) == 0
+            or len({np.shape(network) for network in decision_variables}) != 1
+        ):
+            return super().evaluate_batch(decision_variables)
+
+        weights = np.asarray(decision_variables, dtype=float)
+        x_train = np.asarray(self.X_train)
+        y_train = np.asarray(self.y_train, dtype=float).reshape(len(x_train), -1)
+        num_networks, _, num_nodes = weights.shape
+
+        obj_func = np.full((num_networks, 2), np.nan)
+        obj_func[:, 1] = np.count_nonzero(weights, axis=(1, 2))
+
+        cache = None
+        if self.params["opt_func"] == "llsq_cholesky" and self.params.get(
+            "reuse_gram", False
+        ):
+            if self._gram_cache is None:
+                self._gram_cache = GramCache(
+                    y_train, self.params.get("gram_cache_bytes", 2 ** 28)
+                )
+            cache = self._gram_cache
+
+        chunk = max(1, _MAX_BATCH_ELEMENTS // (len(x_train) * num_nodes))
+        if cache is not None:
+            chunk = max(1, min(chunk, cache.capacity // num_nodes))
+        for start in range(0, num_networks, chunk):
+            stop = start + chunk
+            if cache is not None:
+                training_error = self._cached_training_errors(
+                    weights[start:stop], cache
+                )
+                if training_error is not None:
+                    obj_func[start:stop, 0] = training_error
+                    continue
+
+            # The hidden layers are calculated transposed, shape (networks, nodes,
+            # samples), which is the layout the solver works in.
+            out = np.matmul(np.swapaxes(weights[start:stop, 1:, :], 1, 2), x_train.T)
+            out += np.swapaxes(weights[start:stop, :1, :], 1, 2)
+            activated_layer = self.activate(self.params["activation_func"], out)
+            activated_layer = np.swapaxes(activated_layer, 1, 2)
+            if self.params["opt_func"] == "llsq":
+                linear_layer = lstsq(activated_layer, y_train)
+            else:
+                linear_layer = cholesky_lstsq(activated_layer, y_train)
+            obj_func[start:stop, 0] = self._training_errors(
+                activated_layer @ linear_layer, y_train
+            )
+
+        return obj_func
+
+    def _training_errors(self, predicted_values, y_train):
+        """Training errors of a stack of predictions.
+
+        Parameters
+        ----------
+        predicted_values : np.ndarray
+            Predictions, shape (number of networks, number of samples, number of
+            targets).
+        y_train : np.ndarray
+            Target values, shape (number of samples, number of targets).
+
+        Returns
+        -------
+        np.ndarray
+            The training error of each network.
+        """
+        squared_error = (y_train - predicted_values) ** 2
+        squared_error = squared_error.reshape(len(squared_error), -1)
+
+        if self.params["loss_func"] == "root_mean_square":
+            return np.sqrt(np.mean(squared_error, axis=1))
+
+        elif self.params["loss_func"] == "root_median_square":
+            return np.sqrt(np.median(squared_error, axis=1))
+
+        return np.full(len(squared_error), np.nan)
+
+    def _cached_training_errors(self, weights, cache):
+        """Training errors of networks, reusing the normal equations of hidden nodes
+        seen before.
+
+        A hidden node is identified by its weights. The outputs of the nodes and
+        their dot products are kept in cache, so only the nodes changed since they
+        were last seen are calculated. With the root mean square loss, the error is
+        calculated from the normal equations without predicting.
+
+        Parameters
+        ----------
+        weights : np.ndarray
+            Weight matrices of the networks, shape (number of networks, number of
+            inputs + 1, number of nodes).
+        cache : GramCache
+            The cache of the hidden nodes.
+
+        Returns
+        -------
+        np.ndarray or None
+            The training error of each network. None if the cache is too small for
+            the networks.
+        """
+        num_networks, _, num_nodes = weights.shape
+        nodes = np.ascontiguousarray(np.swapaxes(weights, 1, 2)).reshape(
+            num_networks * num_nodes, -1
+        )
+        # The slots can be reassigned by other threads until the results are used
+        with cache.lock:
+            slots, new = cache.lookup([node.tobytes() for node in nodes])
+            if slots is None:
+                return None
+            if len(new) > 0:
+                out = np.dot(np.asarray(self.X_train), nodes[new, 1:].T)
+                out += nodes[new, 0]
+                cache.store(
+                    slots[new], self.activate(self.params["activation_func"], out)
+                )
+            slots = slots.reshape(num_networks, num_nodes)
+
+            gram, rhs = cache.normal_equations(slots)
+            linear_layer = solve_normal_equations(gram, rhs)
+
+            y_train = cache.target
+            if self.params["loss_func"] == "root_mean_square":
+                # |y - Ax|^2 = y.y - 2 x.(A.y) + x.(A.A x)
+                squared_error = (
+                    np.sum(y_train ** 2)
+                    - 2 * np.sum(linear_layer * rhs, axis=(1, 2))
+                    + np.sum(linear_layer * (gram @ linear_layer), axis=(1, 2))
+                )
+                return np.sqrt(np.maximum(squared_error, 0) / y_train.size)
+
+            activated_layer = np.swapaxes(cache.columns[slots], 1, 2)
+            return self._training_errors(activated_layer @ linear_layer, y_train)
+
     def activation(self, non_linear_layer):
         """ Calculates the dot product and applies the activation function.
         Also get complexity for the lower part of the network.
@@ -150,6 +340,12 @@ class EvoNN(BaseProblem):
                 non_linear_layer, self.y_train, method="bvls", bounds=(0, 1)
             ).x
 
+        elif self.params["opt_func"] == "llsq_cholesky":
+            linear_layer = cholesky_lstsq(
+                non_linear_layer, np.reshape(self.y_train, (len(non_linear_layer), -1))
+            )
+            linear_layer = linear_layer.reshape((-1,) + np.shape(self.y_train)[1:])
+
         predicted_values = np.dot(non_linear_layer, linear_layer)
 
         if self.params["loss_func"] == "root_mean_square":
@@ -203,8 +399,8 @@ class EvoNN(BaseProblem):
             # Return the model with the lowest error
 
             lowest_error = np.argmin(pop.objectives[:, 0])
-            model = pop.individuals[lowest_error]
-            fitness = pop.fitness[lowest_error]
+            model = np.copy(pop.individuals[lowest_error])
+            fitness = np.copy(pop.fitness[lowest_error])
 
         elif selection == "akaike_corrected":
 
@@ -220,8 +416,8 @@ class EvoNN(BaseProblem):
 
             info_c_rank.sort()
 
-            model = pop.individuals[info_c_rank[0][1]]
-            fitness = pop.fitness[info_c_rank[0][1]]
+            model = np.copy(pop.individuals[info_c_rank[0][1]])
+            fitness = np.copy(pop.fitness[info_c_rank[0][1]])
 
         elif selection == "manual":
 
@@ -265,8 +461,8 @@ class EvoNN(BaseProblem):
                 if model_idx not in pop.objectives:
                     print("Model " + str(model_idx) + " not found.")
 
-            model = pop.individuals[int(model_idx)]
-            fitness = pop.fitness[int(model_idx)]
+            model = np.copy(pop.individuals[int(model_idx)])
+            fitness = np.copy(pop.fitness[int(model_idx)])
 
         return model, fitness
 
@@ -334,6 +530,10 @@ class EvoNNModel(EvoNN):
         w_high=5.0,
         activation_func="sigmoid",
         opt_func="llsq",
+        reuse_gram=False,
+        gram_cache_bytes=2 ** 28,
+        subsample_size=None,
+        full_data_iterations=1,
         loss_func="root_median_square",
         selection="akaike_corrected",
         recombination_type="evonn_xover_mutation",
@@ -365,6 +565,25 @@ class EvoNNModel(EvoNN):
             Function to use for activation.
         opt_func : str
             Function to use for optimizing the final layer of the model.
+            "llsq" solves the linear least squares problem, "llsq_cholesky" solves
+            its normal equations, which is faster but less accurate for
+            ill-conditioned problems, and "llsq_constrained" bounds the weights
+            between 0 and 1.
+        reuse_gram : bool
+            With opt_func "llsq_cholesky", keep the outputs of hidden nodes and their
+            dot products between generations, so that only changed nodes are
+            recalculated.
+        gram_cache_bytes : int
+            Maximum size in bytes of the cache used with reuse_gram. To be useful,
+            the cache should have room for about pop_size * num_nodes hidden nodes.
+        subsample_size : int or float or None
+            If given, the training error is calculated on rotating subsamples of
+            this many samples (or this fraction of the samples) during the
+            evolution, see pyrvea.Problem.subsampling.Subsampler. None uses the
+            full data throughout.
+        full_data_iterations : int
+            Number of final iterations which use the full data when subsample_size
+            is given. The model is always selected on the full data.
         loss_func : str
             The loss function to use.
         selection : str
@@ -389,6 +608,10 @@ class EvoNNModel(EvoNN):
             "w_high": w_high,
             "activation_func": activation_func,
             "opt_func": opt_func,
+            "reuse_gram": reuse_gram,
+            "gram_cache_bytes": gram_cache_bytes,
+            "subsample_size": subsample_size,
+            "full_data_iterations": full_data_iterations,
             "loss_func": loss_func,
             "selection": selection,
             "recombination_type": recombination_type,
@@ -435,6 +658,17 @@ class EvoNNModel(EvoNN):
         """Trains the networks and selects the best model from the non dominated front.
 
         """
+        self._gram_cache = None
+        self.subsampler = None
+        if self.params["subsample_size"]:
+            self.subsampler = Subsampler(
+                self.X_train,
+                self.y_train,
+                self.params["subsample_size"],
+                self.params["full_data_iterations"],
+            )
+            # The initial population is evaluated on the first subsample
+            self.start_iteration(0, None)
         pop = Population(
             self,
             assign_type="EvoNN",
@@ -445,6 +679,8 @@ class EvoNNModel(EvoNN):
             mutation_type=self.params["mutation_type"],
         )
         pop.evolve(EA=self.params["training_algorithm"], ea_parameters=self.ea_params)
+        if self.subsampler is not None and self.subsampler.restore(self):
+            pop.reevaluate()
 
         non_dom_front = pop.non_dominated()
         self.non_linear_layer, self.fitness = self.select(
@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+
+
+class Subsampler:
+    """Switch the training data of a problem between rotating subsamples.
+
+    The samples are shuffled once, and each iteration of the evolution uses the next
+    window of subsample_size samples of the shuffled order, wrapping around at the
+    end. The last full_data_iterations iterations use the full data, so that the
+    final population, and the model selected from it, are scored on all samples.
+
+    The first subsample should be set with start_iteration before the initial
+    population is evaluated, so that the population is not evaluated on the full
+    data first. Calling start_iteration again for the same iteration keeps the
+    subsample.
+
+    Parameters
+    ----------
+    X_train : np.ndarray or pd.DataFrame
+        The full training data input.
+    y_train : np.ndarray or pd.DataFrame
+        The full training data target values.
+    subsample_size : int or float
+        Number of samples in a subsample, or a fraction of the samples if less
+        than 1.
+    full_data_iterations : int
+        Number of iterations at the end of the evolution which use the full data.
+    """
+
+    def __init__(self, X_train, y_train, subsample_size, full_data_iterations=1):
+        self.X_train = X_train
+        self.y_train = y_train
+        self.num_samples = len(X_train)
+        if subsample_size < 1:
+            subsample_size = int(round(subsample_size * self.num_samples))
+        self.subsample_size = max(1, min(int(subsample_size), self.num_samples))
+        self.full_data_iterations = full_data_iterations
+        self.order = np.random.permutation(self.num_samples)
+        self.window = 0
+        self.indices = None
+        # Iteration of the current subsample
+        self.iteration = None
+
+    def start_iteration(self, problem, iteration, iterations):
+        """Set the training data of problem for an iteration.
+
+        Sets problem.X_train, problem.y_train and problem.num_samples.
+
+        Parameters
+        ----------
+        problem : BaseProblem
+            The problem whose training data is set.
+        iteration : int
+            Index of the iteration about to start.
+        iterations : int or None
+            Total number of iterations. None if the evolution continues after
+            these iterations, so that the full data is not used yet.
+
+        Returns
+        -------
+        bool
+            True if the training data changed.
+        """
+        if self.subsample_size == self.num_samples or (
+            iterations is not None
+            and iteration >= iterations - self.full_data_iterations
+        ):
+            return self.restore(problem)
+        if self.indices is not None and iteration == self.iteration:
+            return False
+        self.iteration = iteration
+        start = self.window * self.subsample_size
+        self.window += 1
+        self.indices = np.sort(
+            self.order.take(np.arange(start, start + self.subsample_size), mode="wrap")
+        )
+        problem.X_train = self._take(self.X_train, self.indices)
+        problem.y_train = self._take(self.y_train, self.indices)
+        problem.num_samples = self.subsample_size
+        return True
+
+    def restore(self, problem):
+        """Set the training data of problem back to the full data.
+
+        Parameters
+        ----------
+        problem : BaseProblem
+            The problem whose training data is set.
+
+        Returns
+        -------
+        bool
+            True if the training data changed.
+        """
+        if self.indices is None:
+            return False
+        self.indices = None
+        problem.X_train = self.X_train
+        problem.y_train = self.y_train
+        problem.num_samples = self.num_samples
+        return True
+
+    @staticmethod
+    def _take(data, indices):
+        if isinstance(data, (pd.DataFrame, pd.Series)):
+            return data.iloc[indices]
+        return data[indices]
@@ -0,0 +1,53 @@
+import numpy as np
+
+from pyrvea.Problem.biogp_array_tree import grow_subtree
+
+
+def mutate(offspring, individuals, params, *args):
+    """Perform BioGP mutation functions on individuals stored as ArrayTrees.
+
+    Standard mutation:
+    Randomly select and regrow a subtree of an individual.
+
+    Small mutation:
+    Randomly select nodes within a tree and replace them with either a function of
+    the same arity, or another value from the terminal set.
+
+    Mono parental:
+    Randomly swap two subtrees within the same individual.
+
+    Parameters
+    ----------
+    offspring : list
+        List of individuals to mutate.
+    individuals : list
+        List of all individuals.
+    params : dict
+        Parameters for breeding. If None, use defaults.
+
+    """
+
+    prob_mut = params.get("prob_mutation", 0.3)
+    prob_stand = 1 / 3 * prob_mut
+    prob_point = 1 / 3 * prob_mut
+    prob_mono = prob_mut - prob_stand - prob_point
+    prob_replace = prob_mut
+    r = np.random.rand()
+
+    for ind in offspring:
+        if r <= prob_stand:
+            # Standard mutation
+            node = np.random.randint(len(ind))
+            ind.replace(
+                node, grow_subtree(ind.params, method="grow", depth=ind.depths[node])
+            )
+
+        elif r <= prob_point + prob_stand:
+            # Small mutation
+            ind.point_mutation(prob_replace)
+
+        elif r <= prob_mono + prob_point + prob_stand:
+            # Mono parental
+            if len(ind) > 1:
+                node1, node2 = np.random.choice(len(ind), 2, replace=False)
+                ind.swap(node1, node2)
@@ -0,0 +1,68 @@
+import numpy as np
+
+
+def mate(mating_pop, individuals: list, params):
+    """Perform BioGP crossover functions on individuals stored as ArrayTrees.
+    Produce two offsprings by swapping genetic material of the two parents.
+
+    Standard crossover:
+    Swap two random subtrees between the parents.
+
+    Height-fair crossover:
+    Swap two random subtrees between the parents at the selected depth.
+
+    The subtrees are swapped by splicing the arrays of the parents, so the parents
+    are not copied.
+
+    Parameters
+    ----------
+    mating_pop : list
+        List of indices of individuals to mate. If None, choose from population
+        randomly.
+        Each entry should contain two indices, one for each parent.
+    individuals : list
+        List of all individuals.
+    params : dict
+        Parameters for evolution. If None, use defaults.
+
+    Returns
+    -------
+    offspring : list
+        The offsprings produced as a result of crossover.
+    """
+
+    prob_crossover = params.get("prob_crossover", 0.9)
+
+    prob_standard = 0.5
+    prob_height_fair = prob_crossover - prob_standard
+    r = np.random.rand()
+
+    if mating_pop is None:
+        mating_pop = []
+        for i in range(len(individuals)):
+            mating_pop.append([i, np.random.randint(len(individuals))])
+
+    offspring = []
+
+    for mates in mating_pop:
+
+        parent1 = individuals[mates[0]]
+        parent2 = individuals[mates[1]]
+
+        # Height-fair xover
+        if r <= prob_height_fair:
+            depth = min(parent1.total_depth, parent2.total_depth)
+            node1 = np.random.choice(np.flatnonzero(parent1.depths == depth))
+            node2 = np.random.choice(np.flatnonzero(parent2.depths == depth))
+            offspring.extend(parent1.crossover(parent2, node1, node2))
+
+        # Standard xover
+        elif r <= prob_height_fair + prob_standard:
+            node1 = np.random.randint(len(parent1))
+            node2 = np.random.randint(len(parent2))
+            offspring.extend(parent1.crossover(parent2, node1, node2))
+
+        else:
+            offspring.extend((parent1.copy(), parent2.copy()))
+
+    return offspring
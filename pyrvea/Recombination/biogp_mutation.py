@@ -46,16 +46,13 @@ def mutate(
             # This picks a random subtree anywhere within the tree
             rand_node = choice(ind.nodes[1:])
             tree = ind.grow_tree(method="grow", depth=rand_node.depth, ind=rand_node)
-            rand_node.value = tree.value
-            rand_node.roots = tree.roots
+            ind.replace_subtree(rand_node, tree.value, tree.roots)
 
             # This picks a whole subtree at depth=1 under the linear node
             # rand_subtree = np.random.randint(len(ind.roots))
             # del ind.roots[rand_subtree]
             # ind.grow_tree(method="grow", ind=ind)
 
-            ind.nodes = ind.get_sub_nodes()
-
         elif r <= prob_point + prob_stand:
             # Small mutation
             for node in ind.nodes[1:]:
@@ -71,13 +68,7 @@ def mutate(
         elif r <= prob_mono + prob_point + prob_stand:
             # Mono parental
             swap_nodes = sample(ind.nodes[1:], 2)
-            tmp_value = swap_nodes[0].value
-            tmp_roots = swap_nodes[0].roots
-            swap_nodes[0].value = swap_nodes[1].value
-            swap_nodes[0].roots = swap_nodes[1].roots
-            swap_nodes[1].value = tmp_value
-            swap_nodes[1].roots = tmp_roots
-            ind.nodes = ind.get_sub_nodes()
+            ind.swap_subtrees(swap_nodes[0], ind, swap_nodes[1])
 
         else:
             pass
@@ -53,27 +53,13 @@ def mate(mating_pop, individuals: list, params):
             depth = min(offspring1.total_depth, offspring2.total_depth)
             rand_node1 = choice(offspring1.nodes_at_depth[depth])
             rand_node2 = choice(offspring2.nodes_at_depth[depth])
-            tmp_value = rand_node1.value
-            tmp_roots = rand_node1.roots
-            rand_node1.value = rand_node2.value
-            rand_node1.roots = rand_node2.roots
-            rand_node2.value = tmp_value
-            rand_node2.roots = tmp_roots
-            offspring1.nodes = offspring1.get_sub_nodes()
-            offspring2.nodes = offspring2.get_sub_nodes()
+            offspring1.swap_subtrees(rand_node1, offspring2, rand_node2)
 
         # Standard xover
         elif r <= prob_height_fair + prob_standard:
             rand_node1 = choice(offspring1.nodes[1:])  # Exclude linear node
             rand_node2 = choice(offspring2.nodes[1:])
-            tmp_value = rand_node1.value
-            tmp_roots = rand_node1.roots
-            rand_node1.value = rand_node2.value
-            rand_node1.roots = rand_node2.roots
-            rand_node2.value = tmp_value
-            rand_node2.roots = tmp_roots
-            offspring1.nodes = offspring1.get_sub_nodes()
-            offspring2.nodes = offspring2.get_sub_nodes()
+            offspring1.swap_subtrees(rand_node1, offspring2, rand_node2)
 
         else:
             pass
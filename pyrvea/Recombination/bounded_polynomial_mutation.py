@@ -20,37 +20,31 @@ def mutate(offspring, individuals, params, lower_limits, upper_limits):
     """
     dis_mutation = params.get("dis_mutation", 20)
 
-    prob_mutation = 1 / np.array(individuals).shape[1]
-
-    min_val = np.ones_like(offspring) * lower_limits
-    max_val = np.ones_like(offspring) * upper_limits
-    k = np.random.random(offspring.shape)
-    miu = np.random.random(offspring.shape)
-    temp = np.logical_and((k <= prob_mutation), (miu < 0.5))
-    offspring_scaled = (offspring - min_val) / (max_val - min_val)
-    offspring[temp] = offspring[temp] + (
-        (max_val[temp] - min_val[temp])
-        * (
-            (
-                2 * miu[temp]
-                + (1 - 2 * miu[temp])
-                * (1 - offspring_scaled[temp]) ** (dis_mutation + 1)
-            )
-            ** (1 / (dis_mutation + 1))
-            - 1
-        )
-    )
-    temp = np.logical_and((k <= prob_mutation), (miu >= 0.5))
-    offspring[temp] = offspring[temp] + (
-        (max_val[temp] - min_val[temp])
-        * (
-            1
-            - (
-                2 * (1 - miu[temp])
-                + 2 * (miu[temp] - 0.5) * offspring_scaled[temp] ** (dis_mutation + 1)
-            )
-            ** (1 / (dis_mutation + 1))
-        )
-    )
-    offspring[offspring > max_val] = max_val[offspring > max_val]
-    offspring[offspring < min_val] = min_val[offspring < min_val]
+    num_var = offspring.shape[1]
+    prob_mutation = 1 / num_var
+
+    lower_limits = np.broadcast_to(np.asarray(lower_limits, dtype=float), num_var)
+    upper_limits = np.broadcast_to(np.asarray(upper_limits, dtype=float), num_var)
+
+    # Only the mutated positions are gathered and modified
+    rows, cols = np.nonzero(np.random.random(offspring.shape) <= prob_mutation)
+    miu = np.random.random(len(rows))
+    min_val = lower_limits[cols]
+    span = upper_limits[cols] - min_val
+    values = offspring[rows, cols]
+    values_scaled = (values - min_val) / span
+
+    low = miu < 0.5
+    high = ~low
+    step = np.empty(len(rows))
+    step[low] = (
+        2 * miu[low]
+        + (1 - 2 * miu[low]) * (1 - values_scaled[low]) ** (dis_mutation + 1)
+    ) ** (1 / (dis_mutation + 1)) - 1
+    step[high] = 1 - (
+        2 * (1 - miu[high])
+        + 2 * (miu[high] - 0.5) * values_scaled[high] ** (dis_mutation + 1)
+    ) ** (1 / (dis_mutation + 1))
+    offspring[rows, cols] = values + span * step
+
+    np.clip(offspring, lower_limits, upper_limits, out=offspring)
@@ -33,20 +33,29 @@ def mate(mating_pop, pop, params):
             shuffled_ids[i * 2 : (i + 1) * 2] for i in range(int(len(shuffled_ids) / 2))
         ]
 
-    # The rest closely follows the matlab code.
-
-    offsprings = np.zeros((0, num_var))  # empty_like() more efficient?
-
-    for i in range(len(mating_pop)):
-        beta = np.zeros(num_var)
-        miu = np.random.rand(num_var)
-        beta[miu <= 0.5] = (2 * miu[miu <= 0.5]) ** (1 / (dis_crossover + 1))
-        beta[miu > 0.5] = (2 - 2 * miu[miu > 0.5]) ** (-1 / (dis_crossover + 1))
-        beta = beta * ((-1) ** np.random.randint(0, high=2, size=num_var))
-        beta[np.random.rand(num_var) > prob_crossover] = 1  # It was in matlab code
-        avg = (pop[mating_pop[i][0]] + pop[mating_pop[i][1]]) / 2
-        diff = (pop[mating_pop[i][0]] - pop[mating_pop[i][1]]) / 2
-        offsprings = np.vstack((offsprings, avg + beta * diff))
-        offsprings = np.vstack((offsprings, avg - beta * diff))
+    # The rest closely follows the matlab code, done for all pairs at once.
+
+    mating_pop = np.asarray(mating_pop, dtype=int).reshape(-1, 2)
+    num_pairs = len(mating_pop)
+
+    miu = np.random.rand(num_pairs, num_var)
+    beta = np.empty((num_pairs, num_var))
+    low = miu <= 0.5
+    beta[low] = (2 * miu[low]) ** (1 / (dis_crossover + 1))
+    beta[~low] = (2 - 2 * miu[~low]) ** (-1 / (dis_crossover + 1))
+    beta *= (-1) ** np.random.randint(0, high=2, size=(num_pairs, num_var))
+    # It was in matlab code
+    beta[np.random.rand(num_pairs, num_var) > prob_crossover] = 1
+
+    parents1 = pop[mating_pop[:, 0]]
+    parents2 = pop[mating_pop[:, 1]]
+    avg = (parents1 + parents2) / 2
+    diff = (parents1 - parents2) / 2
+    diff *= beta
+
+    # The two offspring of each pair are on consecutive rows
+    offsprings = np.empty((2 * num_pairs, num_var))
+    np.add(avg, diff, out=offsprings[0::2])
+    np.subtract(avg, diff, out=offsprings[1::2])
 
     return offsprings
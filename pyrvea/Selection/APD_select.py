@@ -36,53 +36,35 @@ def APD_select(
         fmin = np.amin(fitness, axis=0)
     translated_fitness = fitness - fmin
     fitness_norm = np.linalg.norm(translated_fitness, axis=1)
-    fitness_norm = np.repeat(fitness_norm, len(translated_fitness[0, :])).reshape(
-        len(fitness), len(fitness[0, :])
-    )
     # Convert zeros to eps to avoid divide by zero.
     # Has to be checked!
-    fitness_norm[fitness_norm == 0] = np.finfo(float).eps
-    normalized_fitness = np.divide(translated_fitness, fitness_norm)  # Checked, works.
+    safe_norm = np.where(fitness_norm == 0, np.finfo(float).eps, fitness_norm)
+    normalized_fitness = translated_fitness / safe_norm[:, np.newaxis]
     cosine = np.dot(normalized_fitness, np.transpose(vectors.values))
-    if cosine[np.where(cosine > 1)].size:
+    if np.any(cosine > 1):
         warn("RVEA.py line 60 cosine larger than 1 decreased to 1")
-        cosine[np.where(cosine > 1)] = 1
-    if cosine[np.where(cosine < 0)].size:
+        cosine[cosine > 1] = 1
+    if np.any(cosine < 0):
         warn("RVEA.py line 64 cosine smaller than 0 increased to 0")
-        cosine[np.where(cosine < 0)] = 0
-    # Calculation of angles between reference vectors and solutions
-    theta = np.arccos(cosine)
-    # Reference vector asub_population_indexssignment
+        cosine[cosine < 0] = 0
+    # Reference vector assignment
     assigned_vectors = np.argmax(cosine, axis=1)
-    selection = np.array([], dtype=int)
+    # Calculation of angles between solutions and their assigned reference vectors
+    theta = np.arccos(cosine[np.arange(len(cosine)), assigned_vectors])
     # Selection
     # Convert zeros to eps to avoid divide by zero.
     # Has to be checked!
     refV[refV == 0] = np.finfo(float).eps
-    for i in range(0, len(vectors.values)):
-        sub_population_index = np.atleast_1d(
-            np.squeeze(np.where(assigned_vectors == i))
-        )
-        sub_population_fitness = translated_fitness[sub_population_index]
-        if len(sub_population_fitness > 0):
-            # APD Calculation
-            angles = theta[sub_population_index, i]
-            angles = np.divide(angles, refV[i])  # This is correct.
-            # You have done this calculation before. Check with fitness_norm
-            # Remove this horrible line
-            sub_pop_fitness_magnitude = np.sqrt(
-                np.sum(np.power(sub_population_fitness, 2), axis=1)
-            )
-            apd = np.multiply(
-                np.transpose(sub_pop_fitness_magnitude),
-                (1 + np.dot(penalty_factor, angles)),
-            )
-            minidx = np.where(apd == np.nanmin(apd))
-            if np.isnan(apd).all():
-                continue
-            selx = sub_population_index[minidx]
-            if selection.shape[0] == 0:
-                selection = np.hstack((selection, np.transpose(selx[0])))
-            else:
-                selection = np.vstack((selection, np.transpose(selx[0])))
-    return selection.squeeze()
+    # APD Calculation
+    apd = fitness_norm * (1 + penalty_factor * theta / refV[assigned_vectors])
+    # Group the individuals by assigned vector, with the smallest APD first in each
+    # group. NaN APDs are sorted last. lexsort is stable, so ties keep the lowest
+    # index.
+    order = np.lexsort((apd, assigned_vectors))
+    sorted_vectors = assigned_vectors[order]
+    group_start = np.ones(len(order), dtype=bool)
+    group_start[1:] = sorted_vectors[1:] != sorted_vectors[:-1]
+    selection = order[group_start]
+    # Skip vectors whose individuals all have NaN APD
+    selection = selection[~np.isnan(apd[selection])]
+    return selection
@@ -1,7 +1,10 @@
+import heapq
+
 import numpy as np
-from pygmo import fast_non_dominated_sorting as nds
 from typing import TYPE_CHECKING
 
+from pyrvea.OtherTools.non_dominated_sorting import non_dominated_sort
+
 if TYPE_CHECKING:
     from pyrvea.allclasses import ReferenceVectors
 
@@ -13,9 +16,10 @@ def NSGAIII_select(
     worst_point: list = None,
     extreme_points: list = None,
     n_survive: int = None,
+    memory_budget: int = None,
 ):
     # Calculating fronts and ranks
-    fronts, dl, dc, rank = nds(fitness)
+    fronts, rank = non_dominated_sort(fitness)
     non_dominated = fronts[0]
 
     # Calculating worst points
@@ -45,7 +49,7 @@ def NSGAIII_select(
     # Selecting individuals from the last acceptable front.
     if len(selection) > n_survive:
         niche_of_individuals, dist_to_niche = associate_to_niches(
-            F, ref_dirs, ideal_point, nadir_point
+            F, ref_dirs, ideal_point, nadir_point, memory_budget=memory_budget
         )
         # if there is only one front
         if len(fronts) == 1:
@@ -136,43 +140,103 @@ def get_nadir_point(
 
 
 def niching(F, n_remaining, niche_count, niche_of_individuals, dist_to_niche):
-    survivors = []
-
-    # boolean array of elements that are considered for each iteration
-    mask = np.full(F.shape[0], True)
+    """Select n_remaining individuals of the last front by niche preservation.
+
+    Repeatedly picks the niche with the fewest survivors (ties broken randomly)
+    among the niches that still have candidates. From a niche without survivors the
+    candidate closest to the reference direction is taken, otherwise a random one.
+
+    The candidates of each niche are put in a queue in the order they will be
+    picked, and the niches are kept in a heap keyed by (niche count, random
+    number), so each survivor is found in O(log(number of niches)).
+
+    Parameters
+    ----------
+    F : np.ndarray
+        Fitness of the individuals of the last front.
+    n_remaining : int
+        Number of individuals to select.
+    niche_count : np.ndarray
+        Number of already selected individuals in each niche. Updated in place.
+    niche_of_individuals : np.ndarray
+        Niche of each individual of the last front.
+    dist_to_niche : np.ndarray
+        Distance of each individual to its niche.
+
+    Returns
+    -------
+    list
+        Indices of the selected individuals in the last front.
+    """
+    n_candidates = F.shape[0]
+
+    # The closest candidate of a niche without survivors is picked first. Ties in
+    # distance are broken randomly.
+    order = np.random.permutation(n_candidates)
+    order = order[np.lexsort((dist_to_niche[order], niche_of_individuals[order]))]
+    niches = niche_of_individuals[order]
+    is_first = np.r_[True, niches[1:] != niches[:-1]]
+    closest = order[is_first & (niche_count[niches] == 0)]
+    # The other candidates are picked in random order. The ranks must be independent
+    # of the tie breaking above.
+    priority = np.empty(n_candidates, dtype=int)
+    priority[np.random.permutation(n_candidates)] = np.arange(n_candidates)
+    priority[closest] = -1
+
+    # Queue of candidates of each niche in pick order
+    order = np.lexsort((priority, niche_of_individuals))
+    niches = niche_of_individuals[order]
+    group_starts = np.flatnonzero(np.r_[True, niches[1:] != niches[:-1]])
+    group_ends = np.r_[group_starts[1:], n_candidates]
+    next_candidate = dict(zip(niches[group_starts].tolist(), group_starts.tolist()))
+    group_end = dict(zip(niches[group_starts].tolist(), group_ends.tolist()))
+
+    heap = [
+        (int(niche_count[niche]), np.random.random(), niche)
+        for niche in next_candidate
+    ]
+    heapq.heapify(heap)
 
+    survivors = []
     while len(survivors) < n_remaining:
-
-        # all niches where new individuals can be assigned to
-        next_niches_list = np.unique(niche_of_individuals[mask])
-
-        # pick a niche with minimum assigned individuals - break tie if necessary
-        next_niche_count = niche_count[next_niches_list]
-        next_niche = np.where(next_niche_count == next_niche_count.min())[0]
-        next_niche = next_niches_list[next_niche]
-        next_niche = next_niche[np.random.randint(0, len(next_niche))]
-
-        # indices of individuals that are considered and assign to next_niche
-        next_ind = np.where(np.logical_and(niche_of_individuals == next_niche, mask))[0]
-
-        # shuffle to break random tie (equal perp. dist) or select randomly
-        np.random.shuffle(next_ind)
-
-        if niche_count[next_niche] == 0:
-            next_ind = next_ind[np.argmin(dist_to_niche[next_ind])]
-        else:
-            # already randomized through shuffling
-            next_ind = next_ind[0]
-
-        mask[next_ind] = False
-        survivors.append(int(next_ind))
-
-        niche_count[next_niche] += 1
+        count, _, niche = heapq.heappop(heap)
+        position = next_candidate[niche]
+        survivors.append(int(order[position]))
+        niche_count[niche] += 1
+        if position + 1 < group_end[niche]:
+            next_candidate[niche] = position + 1
+            heapq.heappush(heap, (count + 1, np.random.random(), niche))
 
     return survivors
 
 
-def associate_to_niches(F, ref_dirs, ideal_point, nadir_point, utopian_epsilon=0.0):
+def associate_to_niches(
+    F, ref_dirs, ideal_point, nadir_point, utopian_epsilon=0.0, memory_budget=None
+):
+    """Associate each individual to the reference direction closest to it.
+
+    Parameters
+    ----------
+    F : np.ndarray
+        Fitness of the individuals.
+    ref_dirs : np.ndarray
+        Reference directions.
+    ideal_point, nadir_point : np.ndarray
+        Used to normalize the fitness.
+    utopian_epsilon : float
+        Distance of the utopian point from the ideal point.
+    memory_budget : int, optional
+        Maximum number of bytes for the distance matrix. If given, the individuals
+        are processed in chunks that fit in the budget. If None, the whole distance
+        matrix is calculated at once.
+
+    Returns
+    -------
+    niche_of_individuals : np.ndarray
+        Index of the closest reference direction of each individual.
+    dist_to_niche : np.ndarray
+        Perpendicular distance of each individual to its reference direction.
+    """
     utopian_point = ideal_point - utopian_epsilon
 
     denom = nadir_point - utopian_point
@@ -180,10 +244,23 @@ def associate_to_niches(F, ref_dirs, ideal_point, nadir_point, utopian_epsilon=0
 
     # normalize by ideal point and intercepts
     N = (F - utopian_point) / denom
-    dist_matrix = calc_perpendicular_distance(N, ref_dirs)
 
-    niche_of_individuals = np.argmin(dist_matrix, axis=1)
-    dist_to_niche = dist_matrix[np.arange(F.shape[0]), niche_of_individuals]
+    if memory_budget is None:
+        chunk_size = len(N)
+    else:
+        # Two temporaries of the size of the distance matrix are needed
+        row_bytes = 2 * np.dtype(float).itemsize * len(ref_dirs)
+        chunk_size = max(1, int(memory_budget // row_bytes))
+
+    niche_of_individuals = np.empty(len(N), dtype=int)
+    dist_to_niche = np.empty(len(N))
+    for start in range(0, len(N), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        dist_matrix = calc_perpendicular_distance(N[chunk], ref_dirs)
+        niche_of_individuals[chunk] = np.argmin(dist_matrix, axis=1)
+        dist_to_niche[chunk] = dist_matrix[
+            np.arange(len(dist_matrix)), niche_of_individuals[chunk]
+        ]
 
     return niche_of_individuals, dist_to_niche
 
@@ -196,14 +273,31 @@ def calc_niche_count(n_niches, niche_of_individuals):
 
 
 def calc_perpendicular_distance(N, ref_dirs):
-    u = np.tile(ref_dirs, (len(N), 1))
-    v = np.repeat(N, len(ref_dirs), axis=0)
-
-    norm_u = np.linalg.norm(u, axis=1)
-
-    scalar_proj = np.sum(v * u, axis=1) / norm_u
-    proj = scalar_proj[:, None] * u / norm_u[:, None]
-    val = np.linalg.norm(proj - v, axis=1)
-    matrix = np.reshape(val, (len(N), len(ref_dirs)))
+    """Calculate the perpendicular distances of points to reference directions.
+
+    Uses ||v - proj_u(v)||^2 = ||v||^2 - (v.u)^2 / ||u||^2, so that only one matrix
+    of shape (len(N), len(ref_dirs)) is created.
+
+    Parameters
+    ----------
+    N : np.ndarray
+        The points, one per row.
+    ref_dirs : np.ndarray
+        The reference directions, one per row.
+
+    Returns
+    -------
+    np.ndarray
+        Distance of each point (row) to each reference direction (column).
+    """
+    ref_dirs = np.asarray(ref_dirs)
+    norm_u_sq = np.sum(ref_dirs * ref_dirs, axis=1)
+    matrix = np.dot(N, ref_dirs.T)
+    matrix *= matrix
+    matrix /= -norm_u_sq
+    matrix += np.sum(N * N, axis=1)[:, None]
+    # Rounding errors can make the squared distance slightly negative
+    np.maximum(matrix, 0, out=matrix)
+    np.sqrt(matrix, out=matrix)
 
     return matrix